@@ -8,14 +8,23 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 from pathlib import Path
 import os
-import yaml
-import subprocess
+import importlib.util
+import multiprocessing
+import queue
 import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Optional
 import time
-import json
+import shutil
+import sys
 from datetime import datetime
 from dotenv import load_dotenv
 
+from inference_worker import worker_main
+import json_io
+from detection_formatter import iso_timestamp
+
 # Load environment variables
 load_dotenv(Path(__file__).parent.parent / '.env')
 
@@ -26,11 +35,11 @@ FIREBASE_ENABLED = bool(
 )
 
 if FIREBASE_ENABLED:
-    try:
-        from firebase_client import FirebaseClient
+    # Only check the SDK is installed - firebase_client is imported on first use
+    if importlib.util.find_spec('firebase_admin') is not None:
         print("🔥 Firebase mode: ENABLED")
-    except Exception as e:
-        print(f"⚠️ Firebase import failed: {e}")
+    else:
+        print("⚠️ Firebase import failed: firebase_admin is not installed")
         FIREBASE_ENABLED = False
         print("📁 Firebase mode: DISABLED - Using local mode")
 else:
@@ -47,107 +56,172 @@ CONFIG_PATH = BASE_DIR / "config.yaml"
 # Ensure upload directory exists
 VIDEO_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
+@dataclass(frozen=True)
+class AnalysisState:
+    """
+    Snapshot of the current analysis.
+    
+    Never mutated - writers swap in a new instance under _analysis_lock,
+    so readers get a consistent snapshot from a single reference read.
+    """
+    running: bool = False
+    session_id: Optional[str] = None
+    video_name: Optional[str] = None
+    start_time: Optional[str] = None
+    future: Optional[Future] = field(default=None, compare=False, repr=False)
+
+
 # Global state
-current_analysis = {
-    "running": False,
-    "session_id": None,
-    "video_name": None,
-    "start_time": None,
-    "process": None
+current_analysis = AnalysisState()
+_analysis_lock = threading.Lock()
+
+
+def update_analysis(**changes) -> AnalysisState:
+    """Atomically replace the analysis state with a copy that has `changes` applied."""
+    global current_analysis
+    with _analysis_lock:
+        current_analysis = replace(current_analysis, **changes)
+        return current_analysis
+
+
+def begin_analysis(session_id: str, video_name: str) -> bool:
+    """
+    Mark a new analysis as running, unless one already is.
+    
+    Returns:
+        True if the new analysis was started
+    """
+    global current_analysis
+    with _analysis_lock:
+        if current_analysis.running:
+            return False
+        # A stop aimed at the previous analysis must not end this one
+        _stop_event.clear()
+        current_analysis = AnalysisState(
+            running=True,
+            session_id=session_id,
+            video_name=video_name,
+            start_time=iso_timestamp(time.time_ns())
+        )
+        return True
+
+# Analysis jobs run one at a time (single GPU / single inference worker)
+_inference_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='infer')
+
+# Persistent inference worker (model loaded once, reused across analyses)
+_mp_context = multiprocessing.get_context('spawn')
+_worker_lock = threading.Lock()
+_worker = {
+    "process": None,
+    "jobs": None,
+    "results": None
 }
 
+# Checked by the worker every frame; created once so a stop can be signalled
+# before the worker has started, and shared by every worker (re)start
+_stop_event = _mp_context.Event()
+
+# Shared Firebase client (created once, see get_firebase_client)
+_firebase_client = None
+_firebase_lock = threading.Lock()
+
+
+def get_firebase_client():
+    """Return the shared FirebaseClient, creating it on first use (None in local mode)."""
+    global _firebase_client
+    if FIREBASE_ENABLED and _firebase_client is None:
+        with _firebase_lock:
+            if _firebase_client is None:
+                from firebase_client import FirebaseClient
+                _firebase_client = FirebaseClient()
+    return _firebase_client
+
 
 def clear_data():
     """Clear old data before new analysis - Firebase or local."""
     if FIREBASE_ENABLED:
         try:
-            client = FirebaseClient()
+            client = get_firebase_client()
             # Delete all existing detections and frames
-            client.delete_data('/detections')
-            client.delete_data('/frames')
-            client.delete_data('/sessions')
+            with _firebase_lock:
+                client.delete_data('/detections')
+                client.delete_data('/frames')
+                client.delete_data('/sessions')
             print("🔥 Firebase data cleared (detections, frames, sessions)")
         except Exception as e:
             print(f"⚠️ Firebase clear failed: {e}")
     else:
         try:
             output_dir = BASE_DIR / "output"
+            detections_log_file = output_dir / "current_detections.ndjson"
             detections_file = output_dir / "current_detections.json"
             session_file = output_dir / "current_session.json"
             
-            if detections_file.exists():
-                detections_file.unlink()
-            if session_file.exists():
-                session_file.unlink()
+            for path in (detections_log_file, detections_file, session_file):
+                if path.exists():
+                    path.unlink()
             
             print("📁 Local detection data cleared")
         except Exception as e:
             print(f"⚠️ Local clear failed: {e}")
 
 
-def update_config_video_path(video_path):
-    """Update config.yaml with new video path."""
-    with open(CONFIG_PATH, 'r') as f:
-        config = yaml.safe_load(f)
-    
-    # Update video path (relative to drone_edge/)
-    relative_path = os.path.relpath(video_path, BASE_DIR)
-    config['video']['input_path'] = relative_path.replace('\\', '/')
-    
-    with open(CONFIG_PATH, 'w') as f:
-        yaml.dump(config, f, default_flow_style=False)
-    
-    print(f"✅ Config updated: {relative_path}")
+def ensure_inference_worker():
+    """Start the persistent inference worker, or restart it if it died."""
+    with _worker_lock:
+        if _worker["process"] is not None and _worker["process"].is_alive():
+            return _worker
+        
+        _worker["jobs"] = _mp_context.Queue()
+        _worker["results"] = _mp_context.Queue()
+        _worker["process"] = _mp_context.Process(
+            target=worker_main,
+            args=(_worker["jobs"], _worker["results"], _stop_event, FIREBASE_ENABLED),
+            name="inference-worker",
+            daemon=True
+        )
+        _worker["process"].start()
+        print(f"🧠 Inference worker started ({'firebase' if FIREBASE_ENABLED else 'local'} mode)")
+        return _worker
 
 
 def run_inference_background(video_path):
-    """Run inference in background thread."""
+    """Dispatch inference to the persistent worker and wait for the result."""
     try:
-        # Update config
-        update_config_video_path(video_path)
-        
-        # Choose script based on Firebase availability
-        if FIREBASE_ENABLED:
-            script_name = "run_inference_firebase.py"
-            print(f"🔥 Using Firebase mode")
-        else:
-            script_name = "run_inference_local.py"
-            print(f"📁 Using local mode")
-        
-        script_path = BASE_DIR / "src" / script_name
-        python_exec = "python"
-        
-        cmd = [python_exec, str(script_path)]
-        
-        print(f"🚀 Starting inference: {' '.join(cmd)}")
-        
-        # Run in subprocess with proper encoding
-        process = subprocess.Popen(
-            cmd,
-            cwd=str(BASE_DIR),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            encoding='utf-8',
-            errors='replace'
-        )
-        
-        current_analysis["process"] = process
-        
-        # Wait for process to complete
-        stdout, stderr = process.communicate()
+        # The path travels in the job - config.yaml and runtime_video.json are not touched
+        session_id = current_analysis.session_id
+        worker = ensure_inference_worker()
+        worker["jobs"].put({
+            "video_path": str(video_path),
+            "session_id": session_id
+        })
         
-        if process.returncode == 0:
+        print(f"🚀 Inference job queued: {video_path}")
+        
+        # Wait for the job result (or for the worker to die)
+        while True:
+            try:
+                result = worker["results"].get(timeout=1.0)
+                break
+            except queue.Empty:
+                if not worker["process"].is_alive():
+                    result = {
+                        "success": False,
+                        "error": f"worker exited with code {worker['process'].exitcode}"
+                    }
+                    break
+        
+        if result["success"]:
             print("✅ Inference completed successfully")
         else:
-            print(f"❌ Inference failed with code {process.returncode}")
-            print(f"Error: {stderr}")
+            print(f"❌ Inference failed")
+            print(f"Error: {result['error']}")
         
-        current_analysis["running"] = False
+        update_analysis(running=False)
         
     except Exception as e:
         print(f"❌ Error running inference: {e}")
-        current_analysis["running"] = False
+        update_analysis(running=False)
 
 
 @app.route('/health', methods=['GET'])
@@ -156,9 +230,42 @@ def health_check():
     return jsonify({"status": "ok", "message": "API server is running"})
 
 
+ALLOWED_VIDEO_EXTENSIONS = frozenset({'.mp4', '.avi', '.mov', '.mkv'})
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MB
+
+
+def _upload_target(original_filename):
+    """
+    Validate the extension and build a timestamped upload path.
+    
+    Returns:
+        (filepath, error_message) - error_message is None when valid
+    """
+    dot = original_filename.rfind('.')
+    file_ext = original_filename[dot:].lower() if dot >= 0 else ''
+    
+    if file_ext not in ALLOWED_VIDEO_EXTENSIONS:
+        return None, f"Invalid file type. Allowed: {', '.join(sorted(ALLOWED_VIDEO_EXTENSIONS))}"
+    
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return VIDEO_UPLOAD_DIR / f"upload_{timestamp}{file_ext}", None
+
+
+def _upload_response(filepath):
+    """Build the JSON response shared by the upload endpoints."""
+    print(f"✅ Video uploaded: {filepath.name}")
+    
+    return jsonify({
+        "success": True,
+        "filename": filepath.name,
+        "filepath": str(filepath),
+        "size_mb": round(filepath.stat().st_size / (1024 * 1024), 2)
+    })
+
+
 @app.route('/upload-video', methods=['POST'])
 def upload_video():
-    """Handle video file upload."""
+    """Handle video file upload (multipart form, field 'video')."""
     try:
         if 'video' not in request.files:
             return jsonify({"error": "No video file provided"}), 400
@@ -168,31 +275,46 @@ def upload_video():
         if video_file.filename == '':
             return jsonify({"error": "No file selected"}), 400
         
-        # Validate file extension
-        allowed_extensions = {'.mp4', '.avi', '.mov', '.mkv'}
-        file_ext = Path(video_file.filename).suffix.lower()
+        filepath, error = _upload_target(video_file.filename)
+        if error:
+            return jsonify({"error": error}), 400
         
-        if file_ext not in allowed_extensions:
-            return jsonify({"error": f"Invalid file type. Allowed: {', '.join(allowed_extensions)}"}), 400
+        video_file.save(str(filepath))
         
-        # Save with timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"upload_{timestamp}{file_ext}"
-        filepath = VIDEO_UPLOAD_DIR / filename
+        return _upload_response(filepath)
         
-        video_file.save(str(filepath))
+    except Exception as e:
+        print(f"❌ Upload error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/upload-video-raw', methods=['PUT', 'POST'])
+def upload_video_raw():
+    """
+    Handle raw video upload - request body is the file itself.
+    
+    Streams the body straight to disk in chunks, skipping Werkzeug's
+    multipart parser and its spooled temp file. Use for large videos.
+    
+    Original filename: ?filename=<name> or X-Filename header.
+    """
+    try:
+        original_filename = request.args.get('filename') or request.headers.get('X-Filename', '')
         
-        print(f"✅ Video uploaded: {filename}")
+        if not original_filename:
+            return jsonify({"error": "No filename provided"}), 400
         
-        return jsonify({
-            "success": True,
-            "filename": filename,
-            "filepath": str(filepath),
-            "size_mb": round(filepath.stat().st_size / (1024 * 1024), 2)
-        })
+        filepath, error = _upload_target(original_filename)
+        if error:
+            return jsonify({"error": error}), 400
+        
+        with open(filepath, 'wb') as f:
+            shutil.copyfileobj(request.stream, f, UPLOAD_CHUNK_SIZE)
+        
+        return _upload_response(filepath)
         
     except Exception as e:
-        print(f"❌ Upload error: {e}")
+        print(f"❌ Raw upload error: {e}")
         return jsonify({"error": str(e)}), 500
 
 
@@ -200,7 +322,7 @@ def upload_video():
 def start_analysis():
     """Start YOLOv8 inference on uploaded video."""
     try:
-        if current_analysis["running"]:
+        if current_analysis.running:
             return jsonify({"error": "Analysis already in progress"}), 400
         
         data = request.json
@@ -217,22 +339,15 @@ def start_analysis():
         # Generate session ID
         session_id = f"session_{int(time.time())}"
         
+        # Update global state (check-and-set, so concurrent requests can't both start)
+        if not begin_analysis(session_id, video_path.name):
+            return jsonify({"error": "Analysis already in progress"}), 400
+        
         # Clear old data (Firebase or local)
         clear_data()
         
-        # Update global state
-        current_analysis["running"] = True
-        current_analysis["session_id"] = session_id
-        current_analysis["video_name"] = video_path.name
-        current_analysis["start_time"] = datetime.now().isoformat()
-        
-        # Start inference in background thread
-        thread = threading.Thread(
-            target=run_inference_background,
-            args=(video_path,),
-            daemon=True
-        )
-        thread.start()
+        # Queue inference on the single-worker pool
+        update_analysis(future=_inference_pool.submit(run_inference_background, video_path))
         
         print(f"🚀 Analysis started: {session_id}")
         
@@ -245,36 +360,38 @@ def start_analysis():
         
     except Exception as e:
         print(f"❌ Analysis start error: {e}")
-        current_analysis["running"] = False
+        update_analysis(running=False)
         return jsonify({"error": str(e)}), 500
 
 
 @app.route('/status', methods=['GET'])
 def get_status():
     """Get current analysis status with completion info."""
+    # Single read - consistent snapshot without locking
+    state = current_analysis
+    
     # Check if analysis recently completed by reading session file
     completed = False
     completion_time = None
     
-    if not current_analysis["running"] and current_analysis["session_id"]:
+    if not state.running and state.session_id:
         try:
             output_dir = BASE_DIR / "output"
             session_file = output_dir / "current_session.json"
             
             if session_file.exists():
-                with open(session_file, 'r') as f:
-                    session_data = json.load(f)
-                    if session_data.get('status') == 'completed':
-                        completed = True
-                        completion_time = session_data.get('end_time')
+                session_data = json_io.read_json(session_file)
+                if session_data.get('status') == 'completed':
+                    completed = True
+                    completion_time = session_data.get('end_time')
         except Exception as e:
             print(f"⚠️ Error reading session file: {e}")
     
     return jsonify({
-        "running": current_analysis["running"],
-        "session_id": current_analysis["session_id"],
-        "video_name": current_analysis["video_name"],
-        "start_time": current_analysis["start_time"],
+        "running": state.running,
+        "session_id": state.session_id,
+        "video_name": state.video_name,
+        "start_time": state.start_time,
         "completed": completed,
         "completion_time": completion_time
     })
@@ -284,33 +401,75 @@ def get_status():
 def stop_analysis():
     """Stop current analysis."""
     try:
-        if current_analysis["process"] and current_analysis["running"]:
-            current_analysis["process"].terminate()
-            current_analysis["running"] = False
-            return jsonify({"success": True, "message": "Analysis stopped"})
-        else:
+        state = current_analysis
+        if not state.running:
             return jsonify({"success": False, "message": "No analysis running"})
+        
+        # Not started yet - drop it from the pool queue
+        if state.future is not None and state.future.cancel():
+            update_analysis(running=False)
+        elif state.future is None or not state.future.done():
+            # Worker checks the stop flag every frame and ends the session (a job
+            # still being dispatched sees it on its first frame); "running" is
+            # cleared by run_inference_background once it reports back
+            _stop_event.set()
+        else:
+            return jsonify({"success": False, "message": "Analysis already finished"})
+        return jsonify({"success": True, "message": "Analysis stopped"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def _json_file_response(path):
+    """
+    Serve a JSON file written by the inference scripts.
+    
+    Files are written atomically (json_io.write_json_atomic), so the bytes
+    are valid JSON and can be sent as-is without a parse/serialize round-trip.
+    """
+    return app.response_class(path.read_bytes(), mimetype='application/json')
+
+
+def _ndjson_detections_response(path):
+    """
+    Serve the live NDJSON detection log as {"session_id", "detections": [...]}.
+    
+    Each line is already a serialized event, so the array is spliced together
+    from the raw lines; only the first event is parsed (for the session id).
+    """
+    with open(path, 'rb') as f:
+        lines = [line.rstrip(b'\n') for line in f if line.endswith(b'\n')]
+    
+    session_id = json_io.loads(lines[0]).get('session_id') if lines else None
+    body = b''.join([
+        b'{"session_id":', json_io.dumps(session_id),
+        b',"detections":[', b','.join(lines), b']}'
+    ])
+    return app.response_class(body, mimetype='application/json')
+
+
 @app.route('/detections', methods=['GET'])
 def get_detections():
     """Get current detections from local storage."""
     try:
         output_dir = BASE_DIR / "output"
+        detections_log_file = output_dir / "current_detections.ndjson"
         detections_file = output_dir / "current_detections.json"
         
-        if not detections_file.exists():
+        # Analysis in progress - serve the live append-only log. Open it
+        # directly: the worker finalizes and unlinks it when the session ends
+        try:
+            return _ndjson_detections_response(detections_log_file)
+        except FileNotFoundError:
+            pass
+        
+        try:
+            return _json_file_response(detections_file)
+        except FileNotFoundError:
             return jsonify({
                 "session_id": None,
                 "detections": []
             })
-        
-        with open(detections_file, 'r') as f:
-            data = json.load(f)
-        
-        return jsonify(data)
     except Exception as e:
         print(f"❌ Error reading detections: {e}")
         return jsonify({"error": str(e)}), 500
@@ -343,10 +502,7 @@ def get_session():
                 "status": "no_session"
             })
         
-        with open(session_file, 'r') as f:
-            data = json.load(f)
-        
-        return jsonify(data)
+        return _json_file_response(session_file)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -376,7 +532,7 @@ def get_chatbot_instance():
             firebase_client = None
             if FIREBASE_ENABLED:
                 try:
-                    firebase_client = FirebaseClient()
+                    firebase_client = get_firebase_client()
                 except Exception as e:
                     print(f"⚠️ Chatbot: Firebase client unavailable: {e}")
             
@@ -438,7 +594,7 @@ def chat_welcome():
         return jsonify({
             "success": True,
             "message": summary,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": iso_timestamp(time.time_ns())
         })
     except Exception as e:
         print(f"❌ Chat welcome error: {e}")
@@ -450,13 +606,28 @@ def chat_welcome():
 
 
 if __name__ == '__main__':
-    print("\n" + "="*60)
-    print("🚀 Starting API Server")
-    print("="*60)
-    print(f"📁 Upload directory: {VIDEO_UPLOAD_DIR}")
-    print(f"⚙️  Config path: {CONFIG_PATH}")
-    print(f"🔥 Firebase mode: {'ENABLED ✅' if FIREBASE_ENABLED else 'DISABLED (using local mode) 📁'}")
-    print("🌐 Server: http://localhost:5000")
-    print("="*60 + "\n")
+    rule = "=" * 60
+    firebase_mode = 'ENABLED ✅' if FIREBASE_ENABLED else 'DISABLED (using local mode) 📁'
+    sys.stdout.write(
+        f"\n{rule}\n"
+        f"🚀 Starting API Server\n"
+        f"{rule}\n"
+        f"📁 Upload directory: {VIDEO_UPLOAD_DIR}\n"
+        f"⚙️  Config path: {CONFIG_PATH}\n"
+        f"🔥 Firebase mode: {firebase_mode}\n"
+        f"🌐 Server: http://localhost:5000\n"
+        f"{rule}\n\n"
+    )
+    sys.stdout.flush()
+    
+    # Spawn the worker up front so the model is warm before the first analysis
+    ensure_inference_worker()
+    
+    # Connect to Firebase once at startup instead of on the first request
+    if FIREBASE_ENABLED:
+        try:
+            get_firebase_client()
+        except Exception as e:
+            print(f"⚠️ Firebase client unavailable: {e}")
     
     app.run(host='0.0.0.0', port=5000, debug=False)
@@ -1,26 +1,47 @@
 """
 chatbot_service.py
 ==================
-LangChain-powered chatbot for precision agriculture drone analytics
+OpenAI-powered chatbot for precision agriculture drone analytics
 Provides intelligent assistance by reading project data and context
 """
 
 import os
-import json
+import time
+from collections import deque
 from pathlib import Path
-from datetime import datetime
 from typing import List, Dict, Optional
 from dotenv import load_dotenv
 
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.schema import HumanMessage, AIMessage, SystemMessage
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationChain
+from config import load_config_file
+import json_io
+from detection_formatter import DetectionFormatter, iso_timestamp
 
 # Load environment variables
 load_dotenv(Path(__file__).parent.parent / '.env')
 
+# Conversation history limits (client-supplied history is trimmed to these)
+MAX_HISTORY_MESSAGES = 6
+MAX_HISTORY_TOKENS = 1500
+
+# Appended to the project summary in the per-turn context message
+RESPONSE_INSTRUCTIONS = """Based on the above project data and your knowledge of precision agriculture, 
+provide a helpful, accurate response. Include specific numbers and references 
+to the detection data when relevant."""
+
+
+def _estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+def _mtime_ns(path: Path) -> Optional[int]:
+    """File modification time in ns, or None if the file does not exist."""
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
 class AgriDroneChatbot:
     """
     Intelligent chatbot for AgriDrone Analytics System
@@ -40,6 +61,17 @@ class AgriDroneChatbot:
         self.base_dir = Path(__file__).resolve().parent.parent
         self.firebase_client = firebase_client
         
+        # Local data files (local mode)
+        output_dir = self.base_dir / "output"
+        self.detections_log_file = output_dir / "current_detections.ndjson"
+        self.detections_file = output_dir / "current_detections.json"
+        self.session_file = output_dir / "current_session.json"
+        self.config_path = self.base_dir / "config.yaml"
+        
+        # (mtime key, value) caches - rebuilt only when the local files change
+        self._detection_cache = (None, None)
+        self._summary_cache = (None, None)
+        
         # Initialize OpenAI (user must set OPENAI_API_KEY in environment)
         api_key = os.getenv('OPENAI_API_KEY')
         if not api_key:
@@ -48,21 +80,18 @@ class AgriDroneChatbot:
                 "Please add it to your .env file."
             )
         
-        # Initialize LangChain ChatOpenAI with newer API
-        self.llm = ChatOpenAI(
-            model="gpt-3.5-turbo",
-            temperature=0.7,
-            api_key=api_key
-        )
-        
-        # Initialize conversation memory
-        self.memory = ConversationBufferMemory(
-            return_messages=True,
-            memory_key="history"
-        )
+        # Initialize OpenAI client (imported here - only needed once a chatbot is created)
+        from openai import OpenAI
+        self.client = OpenAI(api_key=api_key)
+        self.model = "gpt-3.5-turbo"
+        self.temperature = 0.7
         
-        # System prompt with project context
+        # Static system prompt - message built once and reused every turn
         self.system_prompt = self._build_system_prompt()
+        self._system_prompt_msg = {'role': 'system', 'content': self.system_prompt}
+        
+        # Project context message, rebuilt only when the summary text changes
+        self._context_cache = (None, None)
         
     def _build_system_prompt(self) -> str:
         """Build comprehensive system prompt with project context."""
@@ -108,78 +137,93 @@ a precision agriculture platform that uses drone imagery and YOLOv8 AI to detect
 """
     
     def _load_detection_data(self) -> Dict:
-        """Load current detection data from Firebase or local JSON."""
+        """
+        Load a summary of current detection data from Firebase or local JSON.
+        
+        Events are aggregated as they are read (see DetectionFormatter.summarize_events),
+        so large sessions are never held in memory as a full list.
+        """
         try:
             if self.firebase_client:
                 # Try to get data from Firebase
-                detections = self.firebase_client.get_data('/detections')
+                detections = self.firebase_client.get_data('/detections') or {}
                 sessions = self.firebase_client.get_data('/sessions')
                 return {
                     'source': 'firebase',
-                    'detections': detections or {},
+                    'summary': DetectionFormatter.summarize_events(detections.values()),
                     'sessions': sessions or {},
-                    'timestamp': datetime.now().isoformat()
+                    'timestamp': iso_timestamp(time.time_ns())
                 }
             else:
-                # Fallback to local JSON
-                output_dir = self.base_dir / "output"
-                detections_file = output_dir / "current_detections.json"
-                session_file = output_dir / "current_session.json"
+                # Fallback to local JSON (cached until the files change)
+                key = self._local_data_key()
+                if self._detection_cache[0] == key:
+                    return self._detection_cache[1]
                 
-                detections = {}
+                summary = DetectionFormatter.summarize_events(
+                    DetectionFormatter.iter_current_events(self.detections_log_file, self.detections_file)
+                )
                 sessions = {}
                 
-                if detections_file.exists():
-                    with open(detections_file, 'r') as f:
-                        detections = json.load(f)
-                
-                if session_file.exists():
-                    with open(session_file, 'r') as f:
-                        sessions = json.load(f)
+                if self.session_file.exists():
+                    sessions = json_io.read_json(self.session_file)
                 
-                return {
+                data = {
                     'source': 'local',
-                    'detections': detections,
+                    'summary': summary,
                     'sessions': sessions,
-                    'timestamp': datetime.now().isoformat()
+                    'timestamp': iso_timestamp(time.time_ns())
                 }
+                self._detection_cache = (key, data)
+                return data
         except Exception as e:
             return {
                 'source': 'error',
                 'error': str(e),
-                'detections': {},
+                'summary': DetectionFormatter.summarize_events([]),
                 'sessions': {}
             }
     
+    def _local_data_key(self) -> tuple:
+        """mtimes of the local detection/session files - changes whenever they are rewritten."""
+        return (
+            _mtime_ns(self.detections_log_file),
+            _mtime_ns(self.detections_file),
+            _mtime_ns(self.session_file),
+        )
+    
     def _load_config_data(self) -> Dict:
         """Load system configuration from config.yaml."""
         try:
-            import yaml
-            config_path = self.base_dir / "config.yaml"
-            with open(config_path, 'r') as f:
-                config = yaml.safe_load(f)
-            return config
+            return load_config_file(self.config_path)
         except Exception as e:
             return {'error': str(e)}
     
     def _summarize_project_state(self) -> str:
-        """Generate a comprehensive summary of current project state."""
-        detection_data = self._load_detection_data()
-        config_data = self._load_config_data()
+        """
+        Generate a comprehensive summary of current project state.
         
-        # Count detections
-        detections = detection_data.get('detections', {})
-        total_detections = len(detections)
+        In local mode the summary is cached and only rebuilt when the
+        detection, session or config files change.
+        """
+        if self.firebase_client:
+            return self._build_project_summary()
         
-        # Calculate infected area
-        infected_zones = 0
-        disease_types = set()
+        key = self._local_data_key() + (_mtime_ns(self.config_path),)
+        if self._summary_cache[0] != key:
+            self._summary_cache = (key, self._build_project_summary())
+        return self._summary_cache[1]
+    
+    def _build_project_summary(self) -> str:
+        """Build the project state summary text."""
+        detection_data = self._load_detection_data()
+        config_data = self._load_config_data()
         
-        for det_id, det in detections.items():
-            if isinstance(det, dict):
-                infected_zones += 1
-                if 'label' in det:
-                    disease_types.add(det['label'])
+        # Count detections (frames with at least one detection count as infected zones)
+        summary = detection_data['summary']
+        total_detections = summary['detection_count']
+        infected_zones = summary['infected_frames']
+        disease_types = summary['labels']
         
         # Build summary
         summary_parts = [
@@ -239,43 +283,31 @@ a precision agriculture platform that uses drone imagery and YOLOv8 AI to detect
             project_summary = self._summarize_project_state()
             detection_data = self._load_detection_data()
             
-            # Build enhanced prompt with project data
-            enhanced_prompt = f"""{self.system_prompt}
-
----
-{project_summary}
----
-
-**User Query:** {user_message}
-
-Based on the above project data and your knowledge of precision agriculture, 
-provide a helpful, accurate response. Include specific numbers and references 
-to the detection data when relevant.
-"""
-            
-            # Build message history
-            messages = [SystemMessage(content=enhanced_prompt)]
+            # Static system prompt + project data context
+            messages = [self._system_prompt_msg, self._context_message(project_summary)]
             
             # Add conversation history if provided
-            if conversation_history:
-                for msg in conversation_history[-6:]:  # Last 6 messages for context
-                    if msg.get('role') == 'user':
-                        messages.append(HumanMessage(content=msg['content']))
-                    elif msg.get('role') == 'assistant':
-                        messages.append(AIMessage(content=msg['content']))
+            messages.extend(
+                {'role': msg['role'], 'content': msg['content']}
+                for msg in self._trim_history(conversation_history)
+            )
             
             # Add current user message
-            messages.append(HumanMessage(content=user_message))
+            messages.append({'role': 'user', 'content': user_message})
             
-            # Get AI response using invoke() method for newer LangChain
-            response = self.llm.invoke(messages)
+            # Get AI response
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature
+            )
             
             return {
                 'success': True,
-                'response': response.content,
-                'timestamp': datetime.now().isoformat(),
+                'response': response.choices[0].message.content,
+                'timestamp': iso_timestamp(time.time_ns()),
                 'context_data': {
-                    'detections_count': len(detection_data.get('detections', {})),
+                    'detections_count': detection_data['summary']['detection_count'],
                     'data_source': detection_data.get('source'),
                 }
             }
@@ -285,15 +317,47 @@ to the detection data when relevant.
                 'success': False,
                 'response': f"I encountered an error: {str(e)}. Please try again or rephrase your question.",
                 'error': str(e),
-                'timestamp': datetime.now().isoformat()
+                'timestamp': iso_timestamp(time.time_ns())
             }
     
+    def _context_message(self, project_summary: str) -> Dict[str, str]:
+        """Project data message for the current summary (cached while it is unchanged)."""
+        if self._context_cache[0] != project_summary:
+            content = f"---\n{project_summary}\n---\n\n{RESPONSE_INSTRUCTIONS}"
+            self._context_cache = (project_summary, {'role': 'system', 'content': content})
+        return self._context_cache[1]
+    
+    @staticmethod
+    def _trim_history(conversation_history: Optional[List[Dict]]) -> List[Dict]:
+        """
+        Keep the most recent user/assistant messages within the history limits.
+        
+        Args:
+            conversation_history: Client-supplied messages, oldest first
+        
+        Returns:
+            At most MAX_HISTORY_MESSAGES messages totalling at most
+            MAX_HISTORY_TOKENS (estimated), oldest first
+        """
+        recent = deque(
+            (msg for msg in conversation_history or []
+             if msg.get('role') in ('user', 'assistant') and msg.get('content')),
+            maxlen=MAX_HISTORY_MESSAGES
+        )
+        
+        # Drop oldest messages until the history fits the token budget
+        total_tokens = sum(_estimate_tokens(msg['content']) for msg in recent)
+        while recent and total_tokens > MAX_HISTORY_TOKENS:
+            total_tokens -= _estimate_tokens(recent.popleft()['content'])
+        
+        return list(recent)
+    
     def get_quick_summary(self) -> str:
         """Generate a quick status summary for the welcome message."""
         detection_data = self._load_detection_data()
-        detections = detection_data.get('detections', {})
+        infected_zones = detection_data['summary']['infected_frames']
         
-        if not detections:
+        if not infected_zones:
             return ("👋 Welcome to AgriDrone Analytics Support!\n\n"
                    "No detections found yet. Upload a video to start analysis.\n\n"
                    "Ask me about:\n"
@@ -302,7 +366,6 @@ to the detection data when relevant.
                    "• Treatment recommendations\n"
                    "• Field configuration")
         
-        infected_zones = len(detections)
         return (f"👋 Welcome to AgriDrone Analytics Support!\n\n"
                f"📊 Current Status: {infected_zones} disease zones detected\n\n"
                f"Ask me anything about your field analysis, economic impact, "
@@ -4,14 +4,57 @@ config.py
 Configuration management
 """
 
-import yaml
+import functools
+import json
 from pathlib import Path
 from typing import Dict, Any
 
+# Optional per-run video selection for standalone runs (keeps config.yaml static);
+# the API server passes the video to its worker directly and never writes it
+RUNTIME_VIDEO_PATH = Path(__file__).resolve().parent.parent / "runtime_video.json"
+
+
+@functools.lru_cache(maxsize=None)
+def _get_yaml():
+    """
+    Import PyYAML on first use (keeps it out of processes that never parse YAML).
+
+    Returns:
+        (yaml module, loader) - loader prefers the LibYAML C bindings and
+        falls back to the pure-Python SafeLoader
+    """
+    import yaml
+    return yaml, getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def _parse_yaml(path) -> Dict[str, Any]:
+    """Parse a YAML file with the fastest available safe loader."""
+    yaml, loader = _get_yaml()
+    with open(path, "r") as f:
+        return yaml.load(f, Loader=loader)
+
+
+@functools.lru_cache(maxsize=4)
+def _load_config_cached(path: str, mtime_ns: int) -> Dict[str, Any]:
+    """Parse a YAML file; cached per (path, mtime) so unchanged files are not re-parsed."""
+    return _parse_yaml(path)
+
+
+def load_config_file(config_path: Path) -> Dict[str, Any]:
+    """
+    Load a YAML config file, reusing the previous parse while the file is unchanged.
+
+    The returned dict is shared between callers - copy it before mutating.
+    """
+    return _load_config_cached(str(config_path), config_path.stat().st_mtime_ns)
+
 
 def load_config() -> Dict[str, Any]:
     """
     Load configuration from config.yaml located at project root (drone_edge/).
+
+    Parsed once and reused until config.yaml changes on disk; the returned
+    dict is shared between callers and must not be mutated.
     """
 
     # 🔑 Resolve project root (drone_edge/)
@@ -23,7 +66,16 @@ def load_config() -> Dict[str, Any]:
     if not config_path.exists():
         raise FileNotFoundError(f"Config file not found: {config_path}")
 
-    with open(config_path, "r") as f:
-        config = yaml.safe_load(f)
+    return load_config_file(config_path)
+
 
-    return config
+def get_video_input_path(config: Dict[str, Any]) -> str:
+    """
+    Resolve the video to analyse: the runtime selection from runtime_video.json
+    if present, otherwise config.yaml's video.input_path.
+    """
+    try:
+        with open(RUNTIME_VIDEO_PATH, "r") as f:
+            return json.load(f)["input_path"]
+    except (FileNotFoundError, KeyError, ValueError):
+        return config['video']['input_path']
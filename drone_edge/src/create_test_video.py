@@ -1,47 +1,96 @@
 import cv2
 import os
+import itertools
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 image_folder = "video/frames"
 output_video = "video/test.mp4"
 
 valid_ext = (".jpg", ".jpeg", ".png")
 images = sorted(
-    [img for img in os.listdir(image_folder) if img.lower().endswith(valid_ext)]
+    entry.name for entry in os.scandir(image_folder)
+    if entry.is_file() and entry.name.lower().endswith(valid_ext)
 )
 
 if len(images) < 2:
     raise RuntimeError("Need at least 2 images to create a video")
 
+image_paths = [os.path.join(image_folder, image) for image in images]
+
 # Read first image to get target size
-first_path = os.path.join(image_folder, images[0])
-first_frame = cv2.imread(first_path)
+first_frame = cv2.imread(image_paths[0])
 
 if first_frame is None:
     raise RuntimeError(f"Failed to read first image: {images[0]}")
 
 height, width, _ = first_frame.shape
 
-out = cv2.VideoWriter(
-    output_video,
-    cv2.VideoWriter_fourcc(*"mp4v"),
-    5,  # FPS
-    (width, height)
-)
+fps = 5
+
+# Hardware H.264 encoders via GStreamer (NVIDIA, Intel/AMD VA-API).
+# Needs OpenCV built with GStreamer; otherwise falls back to software mp4v.
+hw_encoders = ["nvh264enc", "vaapih264enc"]
+
+out = None
+for encoder in hw_encoders:
+    pipeline = (
+        f"appsrc ! videoconvert ! {encoder} ! h264parse ! mp4mux "
+        f"! filesink location={output_video}"
+    )
+    out = cv2.VideoWriter(pipeline, cv2.CAP_GSTREAMER, 0, fps, (width, height))
+    if out.isOpened():
+        print(f"🎞️  Encoder: {encoder} (hardware H.264)")
+        break
+    out.release()
+    out = None
+
+if out is None:
+    out = cv2.VideoWriter(
+        output_video,
+        cv2.VideoWriter_fourcc(*"mp4v"),
+        fps,
+        (width, height)
+    )
+    print("🎞️  Encoder: mp4v (software)")
+
+# Reused resize target - avoids allocating a new frame per image
+frame_buffer = np.empty((height, width, 3), dtype=np.uint8)
+
+# First image is already decoded and defines the video size
+out.write(first_frame)
+written_frames = 1
+
+# Decode remaining images in parallel (cv2.imread releases the GIL), write in order.
+# Only a sliding window of decodes is in flight, so memory stays bounded when
+# decoding outpaces the encoder.
+decode_workers = os.cpu_count() or 1
+read_ahead = decode_workers * 2
+
+with ThreadPoolExecutor(max_workers=decode_workers) as executor:
+    remaining_paths = iter(image_paths[1:])
+    pending = deque(
+        executor.submit(cv2.imread, path)
+        for path in itertools.islice(remaining_paths, read_ahead)
+    )
 
-written_frames = 0
+    while pending:
+        frame = pending.popleft().result()
 
-for image in images:
-    img_path = os.path.join(image_folder, image)
-    frame = cv2.imread(img_path)
+        next_path = next(remaining_paths, None)
+        if next_path is not None:
+            pending.append(executor.submit(cv2.imread, next_path))
 
-    if frame is None:
-        continue
+        if frame is None:
+            continue
 
-    # ✅ RESIZE frame to match video size
-    frame = cv2.resize(frame, (width, height))
+        # ✅ RESIZE frame to match video size (skipped when it already matches)
+        if frame.shape[:2] != (height, width):
+            frame = cv2.resize(frame, (width, height), dst=frame_buffer)
 
-    out.write(frame)
-    written_frames += 1
+        out.write(frame)
+        written_frames += 1
 
 out.release()
 print(f"✅ Video created successfully with {written_frames} frames")
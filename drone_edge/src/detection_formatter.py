@@ -4,9 +4,50 @@ detection_formatter.py
 Structures detection events for logging and Firebase transmission
 """
 
-from datetime import datetime
-from typing import List, Dict, Any
-import json
+import functools
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Iterator, Union
+import json_io
+
+
+# (epoch second, formatted prefix) of the last timestamp rendered
+_iso_second = (None, '')
+
+
+def iso_timestamp(ns: int) -> str:
+    """
+    Format a time.time_ns() value as an ISO-8601 UTC timestamp.
+    
+    Frames arrive many times per second, so the date/time part is only
+    rebuilt when the second changes; the microseconds are appended directly.
+    
+    Args:
+        ns: Nanoseconds since the epoch
+    
+    Returns:
+        Timestamp such as '2024-01-01T12:00:00.123456+00:00'
+    """
+    global _iso_second
+    
+    sec, rem = divmod(ns, 1_000_000_000)
+    cached_sec, prefix = _iso_second
+    if sec != cached_sec:
+        prefix = datetime.fromtimestamp(sec, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+        _iso_second = (sec, prefix)
+    
+    return f"{prefix}.{rem // 1000:06d}+00:00"
+
+
+@functools.lru_cache(maxsize=8)
+def _image_size(height: int, width: int) -> Dict[str, int]:
+    """
+    Shared image_size sub-dict per frame resolution.
+    
+    Video dimensions are constant within a run, so every event reuses the
+    same (read-only) dict instead of allocating a new one per frame.
+    """
+    return {'width': width, 'height': height}
 
 
 class DetectionFormatter:
@@ -17,7 +58,7 @@ class DetectionFormatter:
     @staticmethod
     def format_detection_event(
         frame_number: int,
-        timestamp: str,
+        timestamp: Union[int, str],
         detections: List[Dict[str, Any]],
         frame_shape: tuple
     ) -> Dict[str, Any]:
@@ -26,24 +67,30 @@ class DetectionFormatter:
         
         Args:
             frame_number: Current frame index
-            timestamp: ISO format timestamp
+            timestamp: time.time_ns() value (formatted here) or ISO timestamp
             detections: List of detection dictionaries
             frame_shape: (height, width, channels)
         
         Returns:
             Structured event dictionary
         """
+        ts_ms = None
+        if isinstance(timestamp, int):
+            ts_ms = timestamp // 1_000_000
+            timestamp = iso_timestamp(timestamp)
+        
         event = {
             'frame_id': frame_number,
             'timestamp': timestamp,
-            'image_size': {
-                'width': frame_shape[1],
-                'height': frame_shape[0]
-            },
+            'image_size': _image_size(frame_shape[0], frame_shape[1]),
             'detection_count': len(detections),
             'detections': detections
         }
         
+        if ts_ms is not None:
+            # Integer epoch for sorting/arithmetic without parsing the ISO string
+            event['ts_ms'] = ts_ms
+        
         return event
     
     @staticmethod
@@ -62,15 +109,70 @@ class DetectionFormatter:
                 print(f"    {i}. {det['class_name']}: {det['confidence']:.1%}")
     
     @staticmethod
-    def save_to_json(events: List[Dict[str, Any]], output_path: str) -> None:
+    def save_to_json(events: List[Dict[str, Any]], output_path: str, indent: bool = False) -> None:
         """
         Save detection events to JSON file.
         
         Args:
             events: List of detection events
             output_path: Output JSON file path
+            indent: Pretty-print the output (slower, for manual inspection)
         """
-        with open(output_path, 'w') as f:
-            json.dump(events, f, indent=2)
+        json_io.write_json_atomic(output_path, events, indent=indent)
         
         print(f"\n💾 Saved {len(events)} events to: {output_path}")
+
+    @staticmethod
+    def iter_current_events(log_path: Path, json_path: Path) -> Iterator[Dict[str, Any]]:
+        """
+        Stream the current session's detection events written by run_inference_local.
+        
+        Reads the live NDJSON log while a run is in progress, or the
+        finalized JSON file once the run has completed.
+        
+        Args:
+            log_path: Live NDJSON event log (current_detections.ndjson)
+            json_path: Finalized JSON file (current_detections.json)
+        
+        Yields:
+            Detection event dictionaries
+        """
+        if log_path.exists():
+            yield from json_io.iter_ndjson(log_path)
+        elif json_path.exists():
+            yield from json_io.iter_json_items(json_path, 'detections')
+    
+    @staticmethod
+    def summarize_events(events: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Aggregate detection events without keeping them in memory.
+        
+        Args:
+            events: Iterable of detection events
+        
+        Returns:
+            Dict with frame_count, infected_frames, detection_count and labels (set)
+        """
+        frame_count = 0
+        infected_frames = 0
+        detection_count = 0
+        labels = set()
+        
+        for event in events:
+            if not isinstance(event, dict):
+                continue
+            
+            frame_count += 1
+            detections = event.get('detections') or []
+            
+            if detections:
+                infected_frames += 1
+                detection_count += len(detections)
+                labels.update(det['class_name'] for det in detections)
+        
+        return {
+            'frame_count': frame_count,
+            'infected_frames': infected_frames,
+            'detection_count': detection_count,
+            'labels': labels
+        }
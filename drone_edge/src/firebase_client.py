@@ -6,11 +6,61 @@ Firebase Realtime Database connection manager
 
 import os
 import json
+import random
+import threading
+import time
 from pathlib import Path
 from typing import Optional, Dict, Any
 import firebase_admin
 from firebase_admin import credentials, db
 from dotenv import load_dotenv
+import json_io
+
+
+# Keep-alive connections shared by concurrent uploads (urllib3 default is 10)
+HTTP_POOL_SIZE = 32
+
+# Firebase push ID alphabet (ASCII-ordered so keys sort chronologically)
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+_push_lock = threading.Lock()
+_last_push_ms = 0
+_last_push_rand = [0] * 12
+
+
+def generate_push_id() -> str:
+    """
+    Generate a Firebase-style push key locally.
+    
+    Same format as the keys the server assigns on ref.push(): 8 timestamp
+    characters followed by 12 random ones, incremented when two keys are
+    generated in the same millisecond so they stay unique and ordered.
+    Lets callers address new children without a round-trip per key.
+    
+    Returns:
+        20-character push key
+    """
+    global _last_push_ms, _last_push_rand
+    
+    now = int(time.time() * 1000)
+    with _push_lock:
+        if now == _last_push_ms:
+            for i in range(11, -1, -1):
+                if _last_push_rand[i] != 63:
+                    _last_push_rand[i] += 1
+                    break
+                _last_push_rand[i] = 0
+        else:
+            _last_push_ms = now
+            _last_push_rand = [random.randrange(64) for _ in range(12)]
+        rand = list(_last_push_rand)
+    
+    timestamp_chars = []
+    for _ in range(8):
+        timestamp_chars.append(PUSH_CHARS[now % 64])
+        now //= 64
+    
+    return ''.join(reversed(timestamp_chars)) + ''.join(PUSH_CHARS[i] for i in rand)
 
 
 class FirebaseClient:
@@ -23,6 +73,9 @@ class FirebaseClient:
     _instance = None
     _initialized = False
     
+    # Resolved references per path (shared by the singleton)
+    _ref_cache: Dict[str, Any] = {}
+    
     def __new__(cls):
         """Singleton pattern implementation."""
         if cls._instance is None:
@@ -89,17 +142,70 @@ class FirebaseClient:
                 })
                 print("🆕 Firebase app initialized")
             
-            # Test connection
-            test_ref = db.reference('/')
-            test_ref.get()  # Will raise error if connection fails
+            # No test read here: even a shallow get() of '/' costs a
+            # round-trip, and the first real write surfaces any error
+            self._configure_http_pool()
             
-            print("✅ Firebase connected successfully")
+            print("✅ Firebase initialized")
             print("=" * 60)
             
         except Exception as e:
             print(f"❌ Firebase initialization failed: {e}")
             raise
     
+    @staticmethod
+    def _configure_http_pool() -> None:
+        """
+        Enlarge the connection pool of the database HTTP session.
+        
+        firebase_admin keeps one requests session per database URL, but its
+        default adapter holds only 10 connections; the parallel upload
+        workers would otherwise keep re-opening TLS connections.
+        """
+        try:
+            from requests.adapters import HTTPAdapter
+            
+            session = db.reference('/')._client.session
+            retries = session.get_adapter('https://').max_retries
+            session.mount('https://', HTTPAdapter(
+                pool_connections=HTTP_POOL_SIZE,
+                pool_maxsize=HTTP_POOL_SIZE,
+                max_retries=retries
+            ))
+        except Exception as e:
+            # Private firebase_admin internals - keep the default pool
+            print(f"⚠️ HTTP pool not configured: {e}")
+    
+    @staticmethod
+    def _send_json(ref, method: str, value: Dict[str, Any]) -> None:
+        """
+        Write a value with a body pre-serialized by json_io (orjson).
+        
+        firebase_admin hands payloads to requests, which encodes them with the
+        stdlib json module; detection batches are large and float-heavy, so
+        encoding them with orjson instead saves most of the serialization
+        time. Same request as ref.set()/ref.update() - 'print=silent'
+        suppresses the echoed response body.
+        
+        Args:
+            ref: Database reference
+            method: 'put' (set) or 'patch' (update)
+            value: JSON-serializable value
+        """
+        client = getattr(ref, '_client', None)
+        if json_io.orjson is None or client is None:
+            # No orjson, or firebase_admin internals changed - use the public API
+            ref.set(value) if method == 'put' else ref.update(value)
+            return
+        
+        client.request(
+            method,
+            ref._add_suffix(),
+            data=json_io.dumps(value),
+            headers={'Content-Type': 'application/json'},
+            params='print=silent'
+        )
+    
     def get_reference(self, path: str = '/'):
         """
         Get a database reference at the specified path.
@@ -110,7 +216,10 @@ class FirebaseClient:
         Returns:
             Firebase database reference
         """
-        return db.reference(path)
+        ref = self._ref_cache.get(path)
+        if ref is None:
+            ref = self._ref_cache[path] = db.reference(path)
+        return ref
     
     def push_data(self, path: str, data: Dict[str, Any]) -> str:
         """
@@ -123,7 +232,7 @@ class FirebaseClient:
         Returns:
             Generated key string
         """
-        ref = db.reference(path)
+        ref = self.get_reference(path)
         result = ref.push(data)
         return result.key
     
@@ -135,8 +244,7 @@ class FirebaseClient:
             path: Full database path (e.g., '/sessions/session_001')
             data: Dictionary to set
         """
-        ref = db.reference(path)
-        ref.set(data)
+        self._send_json(self.get_reference(path), 'put', data)
     
     def update_data(self, path: str, updates: Dict[str, Any]) -> None:
         """
@@ -146,8 +254,9 @@ class FirebaseClient:
             path: Database path
             updates: Dictionary of fields to update
         """
-        ref = db.reference(path)
-        ref.update(updates)
+        if not updates:
+            raise ValueError('Value argument must be a non-empty dictionary.')
+        self._send_json(self.get_reference(path), 'patch', updates)
     
     def get_data(self, path: str) -> Optional[Dict]:
         """
@@ -159,7 +268,7 @@ class FirebaseClient:
         Returns:
             Data dictionary or None if path doesn't exist
         """
-        ref = db.reference(path)
+        ref = self.get_reference(path)
         return ref.get()
     
     def delete_data(self, path: str) -> None:
@@ -169,7 +278,7 @@ class FirebaseClient:
         Args:
             path: Database path to delete
         """
-        ref = db.reference(path)
+        ref = self.get_reference(path)
         ref.delete()
 
 
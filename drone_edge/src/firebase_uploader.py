@@ -4,32 +4,131 @@ firebase_uploader.py
 High-level interface for uploading detection events to Firebase
 """
 
-from datetime import datetime
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Dict, Any, List, Optional
-from firebase_client import FirebaseClient
+from firebase_client import FirebaseClient, generate_push_id
+from detection_formatter import iso_timestamp
+import json_io
 import time
 
 
+# Pending writes are sent as one multi-path update once either limit is hit
+FLUSH_MAX_EVENTS = 50
+FLUSH_INTERVAL_S = 1.0
+
+# Events waiting for the drain thread; the oldest is dropped when full
+UPLOAD_QUEUE_SIZE = 1000
+
+# Bounding boxes are compared on this grid when skipping repeated frames
+DEDUP_GRID_PX = 16
+
+# Failed batches are spooled here and replayed once Firebase is reachable
+SPOOL_DIR = Path(__file__).resolve().parent.parent / 'output'
+SPOOL_RETRY_S = 5.0
+SPOOL_BATCH_MAX = 500
+
+# Queue sentinel telling the drain thread to flush and exit
+_STOP = object()
+
+
 class FirebaseUploader:
     """
     Handles uploading detection events and session metadata to Firebase.
+    
+    Uploads never block the caller: events go onto a bounded queue, a drain
+    thread groups them into multi-path updates (together with the session
+    statistics) and a single upload thread sends those requests in order.
+    Batches that fail are spooled to disk and replayed when the connection
+    recovers.
+    
+    Firebase itself is only initialized on the first upload, so runs that
+    never upload (or have uploads disabled) never connect.
     """
     
-    def __init__(self, session_id: Optional[str] = None):
+    def __init__(self, session_id: Optional[str] = None, enabled: bool = True):
         """
         Initialize uploader.
         
         Args:
             session_id: Unique session identifier (defaults to timestamp)
+            enabled: When False, uploads are ignored and Firebase is never initialized
         """
-        self.client = FirebaseClient()
+        self.enabled = enabled
+        self.client = None
         self.session_id = session_id or f"session_{int(time.time())}"
         self.frame_count = 0
         self.total_detections = 0
-        self.session_start = datetime.now().isoformat()
+        self.dropped_events = 0
+        self.session_start = iso_timestamp(time.time_ns())
+        self._stats_lock = threading.Lock()
+        # Serializes update requests (upload thread and spool replays)
+        self._send_lock = threading.Lock()
+        
+        # Run of consecutive frames with the same detections
+        self._last_event_sig = None
+        self._last_event_key = None
+        self._repeat_frames = 0
+        self._repeat_detections = 0
+        
+        # Newest event timestamp, reused as the session's last_update
+        self._last_event_timestamp = None
+        
+        # Outcome of the most recent update request (initial/spool replays included)
+        self._last_flush_ok = True
+        
+        self._started = False
+    
+    @property
+    def online(self) -> bool:
+        """
+        Whether uploads are currently reaching Firebase: False when uploads are
+        disabled, the last request failed or failed batches are still spooled.
+        """
+        if not self.enabled:
+            return False
+        if not self._started:
+            return True
+        with self._spool_lock:
+            return self._last_flush_ok and self._spool_size() == 0
+    
+    def _start(self) -> None:
+        """Connect, create the session and start the upload threads (first upload only)."""
+        self.client = FirebaseClient()
         
         # Initialize session in Firebase
         self._init_session()
+        
+        # Background upload pipeline
+        self._q: queue.Queue = queue.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+        # One sender: batches carry absolute session counters and child paths
+        # (detections/<key>/duration_frames), so they must land in order
+        self._pool = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix='firebase-upload'
+        )
+        self._drain_thread = threading.Thread(
+            target=self._drain_loop,
+            name='firebase-drain',
+            daemon=True
+        )
+        self._drain_thread.start()
+        
+        # Local spool for failed uploads (opened on first failure)
+        self._spool_path = SPOOL_DIR / f'{self.session_id}.spool.jsonl'
+        self._spool_file = None
+        self._spool_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._spool_thread = threading.Thread(
+            target=self._spool_loop,
+            name='firebase-spool',
+            daemon=True
+        )
+        self._spool_thread.start()
+        self._started = True
     
     def _init_session(self) -> None:
         """Create session metadata in Firebase."""
@@ -44,88 +143,312 @@ class FirebaseUploader:
         self.client.set_data(f'/sessions/{self.session_id}', session_data)
         print(f"\n📊 Session initialized: {self.session_id}")
     
+    def _enqueue(self, item: tuple) -> None:
+        """Queue an item without blocking, dropping the oldest on overflow."""
+        while True:
+            try:
+                self._q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._q.get_nowait()
+                    self.dropped_events += 1
+                except queue.Empty:
+                    pass
+    
+    @staticmethod
+    def _event_signature(event: Dict[str, Any]) -> tuple:
+        """
+        Coarse signature of a frame's detections.
+        
+        Boxes are snapped to a DEDUP_GRID_PX grid so the same object drifting
+        a few pixels between frames still matches.
+        """
+        grid = DEDUP_GRID_PX
+        return tuple(sorted(
+            (d['class_id'],
+             round(d['bbox']['x1'] / grid), round(d['bbox']['y1'] / grid),
+             round(d['bbox']['x2'] / grid), round(d['bbox']['y2'] / grid))
+            for d in event['detections']
+        ))
+    
+    def _close_repeat_run(self) -> None:
+        """Record how many frames the last uploaded event stood for."""
+        if self._repeat_frames:
+            self._enqueue((
+                f'detections/{self._last_event_key}/duration_frames',
+                self._repeat_frames + 1,
+                0,
+                self._repeat_detections
+            ))
+            self._repeat_frames = 0
+            self._repeat_detections = 0
+    
     def upload_detection_event(self, event: Dict[str, Any]) -> str:
         """
-        Upload a single detection event.
+        Queue a single detection event for upload.
+        
+        Frames whose detections match the previous frame are not uploaded;
+        the previous event gets a duration_frames field instead.
         
         Args:
             event: Detection event dictionary (from detection_formatter)
         
         Returns:
-            Firebase-generated key
+            Client-generated Firebase key (of the previous event if skipped),
+            None when uploads are disabled
         """
-        # Add session context
-        event_with_session = {
-            **event,
-            'session_id': self.session_id
-        }
+        if not self._started:
+            if not self.enabled:
+                return None
+            self._start()
         
-        # Push to Firebase
-        try:
-            key = self.client.push_data('/detections', event_with_session)
-            self.total_detections += event.get('detection_count', 0)
-            return key
-        except Exception as e:
-            print(f"⚠️ Firebase upload failed: {e}")
-            # Don't crash inference - log and continue
-            return None
+        self._last_event_timestamp = event.get('timestamp')
+        
+        sig = self._event_signature(event)
+        if sig == self._last_event_sig:
+            self._repeat_frames += 1
+            self._repeat_detections += event.get('detection_count', 0)
+            return self._last_event_key
+        
+        self._close_repeat_run()
+        
+        # Add session context
+        key = generate_push_id()
+        self._enqueue((
+            f'detections/{key}',
+            {**event, 'session_id': self.session_id},
+            0,
+            event.get('detection_count', 0)
+        ))
+        self._last_event_sig = sig
+        self._last_event_key = key
+        return key
     
     def upload_frame_summary(self, frame_data: Dict[str, Any]) -> str:
         """
-        Upload frame-level summary.
+        Queue a frame-level summary for upload.
         
         Args:
             frame_data: Frame metadata (frame_id, timestamp, detection_count, etc.)
         
         Returns:
-            Firebase-generated key
+            Client-generated Firebase key, None when uploads are disabled
         """
-        frame_with_session = {
-            **frame_data,
-            'session_id': self.session_id
-        }
+        if not self._started:
+            if not self.enabled:
+                return None
+            self._start()
         
-        try:
-            key = self.client.push_data('/frames', frame_with_session)
-            self.frame_count += 1
+        key = generate_push_id()
+        self._enqueue((f'frames/{key}', {**frame_data, 'session_id': self.session_id}, 1, 0))
+        return key
+    
+    @staticmethod
+    def _add_to_batch(batch: Dict[str, Any], path: str, value: Any) -> None:
+        """
+        Add a multi-path entry, merging it with its parent or children if present.
+        
+        RTDB rejects an update containing both a path and its child. Either can
+        come first: spool replay may see a child (e.g. detections/<key>/duration_frames)
+        before its parent event, in which case the child - the later write - wins.
+        """
+        parent, _, field = path.rpartition('/')
+        if parent in batch:
+            batch[parent][field] = value
+            return
+        
+        if isinstance(value, dict):
+            prefix = path + '/'
+            children = [child for child in batch if child.startswith(prefix)]
+            if children:
+                value = dict(value)
+                for child in children:
+                    value[child[len(prefix):]] = batch.pop(child)
+        batch[path] = value
+    
+    def _drain_loop(self) -> None:
+        """Group queued items into batches and hand them to the upload pool."""
+        batch: Dict[str, Any] = {}
+        frames = 0
+        detections = 0
+        deadline = time.monotonic() + FLUSH_INTERVAL_S
+        
+        while True:
+            try:
+                item = self._q.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            
+            if item is _STOP:
+                if batch:
+                    self._pool.submit(self._flush_batch, batch, frames, detections)
+                return
             
-            # Update session stats
-            self._update_session_stats()
+            if item is not None:
+                path, value, item_frames, item_detections = item
+                self._add_to_batch(batch, path, value)
+                frames += item_frames
+                detections += item_detections
             
-            return key
-        except Exception as e:
-            print(f"⚠️ Frame upload failed: {e}")
-            return None
-    
-    def _update_session_stats(self) -> None:
-        """Update session statistics in Firebase."""
-        updates = {
-            'frame_count': self.frame_count,
-            'total_detections': self.total_detections,
-            'last_update': datetime.now().isoformat()
+            if len(batch) >= FLUSH_MAX_EVENTS or (batch and time.monotonic() >= deadline):
+                self._pool.submit(self._flush_batch, batch, frames, detections)
+                batch = {}
+                frames = 0
+                detections = 0
+            
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + FLUSH_INTERVAL_S
+    
+    def _session_stats(self) -> Dict[str, Any]:
+        """Session statistics as multi-path update entries."""
+        prefix = f'sessions/{self.session_id}'
+        return {
+            f'{prefix}/frame_count': self.frame_count,
+            f'{prefix}/total_detections': self.total_detections,
+            f'{prefix}/last_update': self._last_event_timestamp or iso_timestamp(time.time_ns())
         }
+    
+    def _flush_batch(self, entries: Dict[str, Any], frames: int, detections: int) -> bool:
+        """
+        Write one batch and the session statistics in a single request.
+        
+        Args:
+            entries: Multi-path entries ({'detections/<key>': event, ...})
+            frames: Frame summaries contained in the batch
+            detections: Detections contained in the batch
+        
+        Returns:
+            True if the update succeeded (otherwise the batch is spooled)
+        """
+        # Statistics are snapshotted under the send lock, so the session
+        # counters and last_update never go backwards in the database
+        with self._send_lock:
+            with self._stats_lock:
+                self.frame_count += frames
+                self.total_detections += detections
+                updates = {**entries, **self._session_stats()}
+            
+            try:
+                self.client.update_data('/', updates)
+            except Exception as e:
+                self._last_flush_ok = False
+                print(f"⚠️ Firebase upload failed: {e} - spooled {len(entries)} entries")
+                # Don't crash inference - keep the batch for replay
+                with self._stats_lock:
+                    self.frame_count -= frames
+                    self.total_detections -= detections
+                self._spool(entries, frames, detections)
+                return False
+            
+            self._last_flush_ok = True
+            return True
+    
+    def _spool(self, entries: Dict[str, Any], frames: int, detections: int) -> None:
+        """Append a failed batch to the local spool file."""
+        record = {'entries': entries, 'frames': frames, 'detections': detections}
+        line = json_io.dumps(record) + b'\n'
         
         try:
-            self.client.update_data(f'/sessions/{self.session_id}', updates)
-        except Exception as e:
-            print(f"⚠️ Session update failed: {e}")
+            with self._spool_lock:
+                if self._spool_file is None:
+                    self._spool_path.parent.mkdir(parents=True, exist_ok=True)
+                    self._spool_file = open(self._spool_path, 'ab', buffering=0)
+                self._spool_file.write(line)
+        except OSError as e:
+            print(f"⚠️ Spool write failed, batch lost: {e}")
+    
+    def _spool_size(self) -> int:
+        """Bytes currently waiting in the spool."""
+        if self._spool_file is None:
+            return 0
+        return os.fstat(self._spool_file.fileno()).st_size
+    
+    def _flush_spool(self) -> bool:
+        """
+        Replay spooled batches as multi-path updates of up to SPOOL_BATCH_MAX entries.
+        
+        Returns:
+            True if the spool is empty afterwards
+        """
+        with self._spool_lock:
+            if self._spool_size() == 0:
+                return True
+            records = json_io.read_ndjson(self._spool_path)
+            self._spool_file.truncate(0)
+        
+        entry_count = sum(len(record['entries']) for record in records)
+        replayed = True
+        batch: Dict[str, Any] = {}
+        frames = 0
+        detections = 0
+        
+        for record in records:
+            for path, value in record['entries'].items():
+                self._add_to_batch(batch, path, value)
+            frames += record['frames']
+            detections += record['detections']
+            
+            if len(batch) >= SPOOL_BATCH_MAX:
+                replayed &= self._flush_batch(batch, frames, detections)
+                batch = {}
+                frames = 0
+                detections = 0
+        
+        if batch:
+            replayed &= self._flush_batch(batch, frames, detections)
+        
+        if replayed:
+            print(f"📤 Replayed {entry_count} spooled entries")
+        return replayed
+    
+    def _spool_loop(self) -> None:
+        """Retry the spool periodically until the session ends."""
+        while not self._closed.wait(SPOOL_RETRY_S):
+            self._flush_spool()
     
-    def end_session(self) -> None:
-        """Mark session as complete."""
+    def end_session(self, status: str = 'completed') -> None:
+        """
+        Upload remaining events and mark the session as ended.
+        
+        Args:
+            status: Final session status ('completed', 'stopped' or 'failed')
+        """
+        if not self._started:
+            print(f"\n📊 Session ended: {self.session_id} (nothing uploaded)")
+            return
+        
+        self._close_repeat_run()
+        self._enqueue(_STOP)
+        self._drain_thread.join()
+        self._pool.shutdown(wait=True)
+        
+        self._closed.set()
+        self._spool_thread.join()
+        self._flush_spool()
+        
+        prefix = f'sessions/{self.session_id}'
         end_data = {
-            'status': 'completed',
-            'end_time': datetime.now().isoformat(),
-            'frame_count': self.frame_count,
-            'total_detections': self.total_detections
+            f'{prefix}/status': status,
+            f'{prefix}/end_time': iso_timestamp(time.time_ns())
         }
         
-        try:
-            self.client.update_data(f'/sessions/{self.session_id}', end_data)
+        if self._flush_batch(end_data, 0, 0):
             print(f"\n📊 Session ended: {self.session_id}")
             print(f"   Frames: {self.frame_count}")
             print(f"   Detections: {self.total_detections}")
-        except Exception as e:
-            print(f"⚠️ Session end failed: {e}")
+            if self.dropped_events:
+                print(f"   Dropped (upload backlog): {self.dropped_events}")
+        else:
+            print("⚠️ Session end failed")
+        
+        if self._spool_file is not None:
+            unsent = self._spool_size()
+            self._spool_file.close()
+            if unsent:
+                print(f"⚠️ Unsent entries kept in: {self._spool_path}")
+            else:
+                self._spool_path.unlink()
 
 
 # Example usage
@@ -137,7 +460,7 @@ if __name__ == "__main__":
         # Simulate detection event
         test_event = {
             'frame_id': 1,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': iso_timestamp(time.time_ns()),
             'image_size': {'width': 1280, 'height': 720},
             'detection_count': 2,
             'detections': [
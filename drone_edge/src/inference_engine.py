@@ -5,21 +5,47 @@ YOLOv8 Model Loading and Inference Engine for Edge Deployment
 """
 
 import time
+from collections import deque
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple, Union
+import cv2
 import numpy as np
 from ultralytics import YOLO
 import torch
 
 
+# Rolling window for the average inference time (bounded memory on long flights)
+INFERENCE_TIME_WINDOW = 1000
+
+# Largest batch the exported TensorRT engine accepts (see predict_batch)
+TENSORRT_MAX_BATCH = 8
+
+# Per-frame model output before formatting: class ids, confidences, int xyxy boxes
+RawDetections = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+# Raw model path (raw_inference=True): letterbox size and ultralytics' NMS defaults
+RAW_INPUT_SIZE = 640
+NMS_IOU_THRESHOLD = 0.7
+MAX_DETECTIONS = 300
+
+
 class InferenceEngine:
     """
     Handles YOLOv8 model loading and inference on edge devices.
     """
 
-    def __init__(self, model_path: str, conf_threshold: float = 0.25):
+    def __init__(self, model_path: str, conf_threshold: float = 0.25, tensorrt: bool = False,
+                 raw_inference: bool = False):
         """
         Initialize inference engine.
+
+        Args:
+            model_path: Path to the .pt weights (relative to drone_edge/)
+            conf_threshold: Minimum detection confidence
+            tensorrt: Run a TensorRT FP16 engine exported next to the weights
+                (an ONNX export on CPU-only machines)
+            raw_inference: Call the PyTorch model directly with our own letterbox
+                and torchvision NMS instead of ultralytics' predict (.pt weights only)
         """
         # 🔑 FIX: Resolve project root (drone_edge/)
         self.base_dir = Path(__file__).resolve().parent.parent
@@ -28,11 +54,18 @@ class InferenceEngine:
         self.model_path = (self.base_dir / model_path).resolve()
 
         self.conf_threshold = conf_threshold
+        self.tensorrt = tensorrt
+        self.raw_inference = raw_inference
         self.model = None
+        self.raw_model = None
         self.class_names = []
+        self.label_prefixes = {}
+        self.input_size = RAW_INPUT_SIZE
+        self.max_batch = 0  # frames per model call (0 = no limit)
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
-        self.inference_times = []
+        self.inference_times = deque(maxlen=INFERENCE_TIME_WINDOW)
+        self._inference_time_sum = 0.0
 
         self._load_model()
 
@@ -52,12 +85,35 @@ class InferenceEngine:
         print(f"🖥️  Device: {self.device.upper()}")
 
         try:
-            self.model = YOLO(str(self.model_path))
+            weights = self.model_path
+            warmup_runs = 1
+            if self.tensorrt:
+                weights = self._tensorrt_engine()
+                if weights != self.model_path:
+                    # First TensorRT runs allocate buffers and pick kernels
+                    warmup_runs = 3
+
+            self.model = YOLO(str(weights), task='detect')
+            if weights.suffix == '.engine':
+                # The engine's batch dimension is fixed at export; larger
+                # model.batch_size batches are split in predict_batch
+                self.max_batch = TENSORRT_MAX_BATCH
             self.class_names = self.model.names
 
+            # "name: " per class id, so overlays only append the confidence
+            self.label_prefixes = {cid: f"{name}: " for cid, name in self.class_names.items()}
+
             print("⏳ Warming up model...")
             dummy_input = np.zeros((640, 640, 3), dtype=np.uint8)
-            _ = self.model.predict(dummy_input, verbose=False)
+            for _ in range(warmup_runs):
+                _ = self.model.predict(dummy_input, verbose=False, device=self.device)
+
+            if self.raw_inference:
+                if weights == self.model_path:
+                    self._setup_raw_model()
+                    self.predict_batch([dummy_input])
+                else:
+                    print("⚠️ Raw inference needs .pt weights - using the exported model")
 
             print("✅ Model loaded successfully")
             print(f"📊 Classes: {len(self.class_names)}")
@@ -67,43 +123,271 @@ class InferenceEngine:
         except Exception as e:
             raise RuntimeError(f"Failed to load model: {e}")
 
+    def _tensorrt_engine(self) -> Path:
+        """
+        Locate (or build) the TensorRT engine for the weights.
+
+        The FP16 engine is exported once to best.engine next to best.pt and
+        re-exported when the weights are newer. Without CUDA an ONNX export
+        (best.onnx) is used instead. Falls back to the .pt weights when the
+        export fails.
+
+        Returns:
+            Path of the model file to load
+        """
+        if self.device != 'cuda':
+            print("⚠️ TensorRT requires CUDA - using ONNX export for CPU")
+            return self._onnx_model()
+
+        engine_path = self._cached_export('.engine')
+        if engine_path is not None:
+            print(f"🚀 TensorRT engine: {engine_path.name}")
+            return engine_path
+
+        print("⏳ Exporting TensorRT FP16 engine (one-time, may take minutes)...")
+        try:
+            exported = YOLO(str(self.model_path)).export(
+                format='engine',
+                half=True,
+                imgsz=640,
+                dynamic=True,
+                batch=TENSORRT_MAX_BATCH,
+                device=0
+            )
+        except Exception as e:
+            print(f"⚠️ TensorRT export failed ({e}) - using PyTorch weights")
+            return self.model_path
+
+        print(f"🚀 TensorRT engine: {Path(exported).name}")
+        return Path(exported)
+
+    def _onnx_model(self) -> Path:
+        """
+        Locate (or build) the ONNX export used for CPU inference.
+
+        Returns:
+            Path of the model file to load
+        """
+        onnx_path = self._cached_export('.onnx')
+        if onnx_path is not None:
+            print(f"🚀 ONNX model: {onnx_path.name}")
+            return onnx_path
+
+        print("⏳ Exporting ONNX model (one-time)...")
+        try:
+            exported = YOLO(str(self.model_path)).export(
+                format='onnx',
+                imgsz=640,
+                dynamic=True,
+                simplify=True
+            )
+        except Exception as e:
+            print(f"⚠️ ONNX export failed ({e}) - using PyTorch weights")
+            return self.model_path
+
+        print(f"🚀 ONNX model: {Path(exported).name}")
+        return Path(exported)
+
+    def _cached_export(self, suffix: str) -> Optional[Path]:
+        """Return the export next to the weights if it is at least as new, else None."""
+        export_path = self.model_path.with_suffix(suffix)
+        if export_path.exists() and export_path.stat().st_mtime >= self.model_path.stat().st_mtime:
+            return export_path
+        return None
+
+    def _setup_raw_model(self) -> None:
+        """Prepare direct calls into the PyTorch model (no ultralytics predictor)."""
+        import torchvision
+
+        model = self.model.model
+        if hasattr(model, 'fuse'):
+            model = model.fuse(verbose=False)
+        model = model.to(self.device).eval()
+
+        self._half = self.device == 'cuda'
+        if self._half:
+            model = model.half()
+
+        self._nms = torchvision.ops.batched_nms
+        self.raw_model = model
+        print("⚡ Raw inference: direct model call + torchvision NMS")
+
+    @staticmethod
+    def _letterbox(frame: np.ndarray) -> Tuple[np.ndarray, float, int, int]:
+        """
+        Resize keeping aspect ratio and pad to RAW_INPUT_SIZE (as ultralytics does).
+
+        Returns:
+            (padded image, scale, left pad, top pad)
+        """
+        h, w = frame.shape[:2]
+        scale = min(RAW_INPUT_SIZE / h, RAW_INPUT_SIZE / w)
+        new_w, new_h = round(w * scale), round(h * scale)
+        if (new_w, new_h) != (w, h):
+            frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+
+        pad_x = (RAW_INPUT_SIZE - new_w) / 2
+        pad_y = (RAW_INPUT_SIZE - new_h) / 2
+        top, bottom = round(pad_y - 0.1), round(pad_y + 0.1)
+        left, right = round(pad_x - 0.1), round(pad_x + 0.1)
+        frame = cv2.copyMakeBorder(
+            frame, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114)
+        )
+        return frame, scale, left, top
+
+    def _predict_raw(self, frames: List[np.ndarray],
+                     scales: List[Optional[Tuple[float, float]]]) -> List[RawDetections]:
+        """Run the raw model on a batch and post-process with torchvision NMS."""
+        letterboxed = [self._letterbox(frame) for frame in frames]
+
+        # BGR HWC uint8 -> RGB CHW float in [0, 1]
+        batch = np.stack([image for image, _, _, _ in letterboxed])
+        batch = np.ascontiguousarray(batch[..., ::-1].transpose(0, 3, 1, 2))
+        tensor = torch.from_numpy(batch).to(self.device, non_blocking=True)
+        tensor = (tensor.half() if self._half else tensor.float()) / 255.0
+
+        with torch.inference_mode():
+            preds = self.raw_model(tensor)
+            if isinstance(preds, (list, tuple)):
+                preds = preds[0]
+
+            outputs = []
+            for pred, frame, (_, scale, left, top), frame_scale in zip(preds, frames, letterboxed, scales):
+                # (4 + classes, anchors) -> (anchors, 4 + classes)
+                pred = pred.transpose(0, 1).float()
+                scores, class_ids = pred[:, 4:].max(1)
+                keep = scores > self.conf_threshold
+                pred, scores, class_ids = pred[keep], scores[keep], class_ids[keep]
+
+                # cx, cy, w, h -> x1, y1, x2, y2
+                centers, sizes = pred[:, :2], pred[:, 2:4] / 2
+                boxes = torch.cat((centers - sizes, centers + sizes), 1)
+
+                keep = self._nms(boxes, scores, class_ids, NMS_IOU_THRESHOLD)[:MAX_DETECTIONS]
+                boxes, scores, class_ids = boxes[keep], scores[keep], class_ids[keep]
+
+                # Undo letterbox and clip to the original frame
+                h, w = frame.shape[:2]
+                boxes -= boxes.new_tensor([left, top, left, top])
+                boxes /= scale
+                boxes[:, 0::2] = boxes[:, 0::2].clamp(0, w)
+                boxes[:, 1::2] = boxes[:, 1::2].clamp(0, h)
+
+                outputs.append((
+                    class_ids.cpu().numpy().astype(np.int32),
+                    scores.cpu().numpy(),
+                    self._to_pixels(boxes.cpu().numpy(), frame_scale)
+                ))
+
+        return outputs
+
     def predict(self, frame: np.ndarray) -> List[Dict[str, Any]]:
-        start_time = time.time()
+        return self.predict_batch([frame])[0]
+
+    def predict_batch(self, frames: List[np.ndarray],
+                      scales: Optional[List[Tuple[float, float]]] = None,
+                      return_arrays: bool = False
+                      ) -> Union[List[List[Dict[str, Any]]],
+                                 Tuple[List[List[Dict[str, Any]]], List[np.ndarray]]]:
+        """
+        Run the model on several frames in one call.
+
+        Amortizes the per-call framework and kernel launch overhead. With a
+        TensorRT engine the frames are sent in chunks of at most max_batch.
+
+        Args:
+            frames: BGR frames
+            scales: Per-frame (x, y) factors the frames were downscaled by
+                (see AsyncVideoProcessor.read_frame_for_inference); boxes are
+                mapped back to the full-resolution frame
+            return_arrays: Also return each frame's detections as an (N, 6)
+                int32 array of [x1, y1, x2, y2, class_id, confidence %]
+                (cheap to iterate when drawing)
+
+        Returns:
+            Detection list per frame, in input order
+            (and the per-frame arrays when return_arrays is set)
+        """
+        start_time = time.perf_counter()
+
+        if scales is None:
+            scales = [None] * len(frames)
 
-        results = self.model.predict(
-            frame,
-            conf=self.conf_threshold,
-            verbose=False,
-            device=self.device
+        if self.raw_model is not None:
+            outputs = self._predict_raw(frames, scales)
+        else:
+            step = self.max_batch or len(frames)
+            results = []
+            for i in range(0, len(frames), step):
+                results.extend(self.model.predict(
+                    frames[i:i + step],
+                    conf=self.conf_threshold,
+                    verbose=False,
+                    device=self.device
+                ))
+            outputs = [self._parse_results(result, scale) for result, scale in zip(results, scales)]
+
+        detections = [self._build_detections(*output) for output in outputs]
+
+        # Record the per-frame share so averages stay comparable across batch sizes
+        elapsed_ms = (time.perf_counter() - start_time) * 1000 / len(frames)
+        for _ in frames:
+            if len(self.inference_times) == self.inference_times.maxlen:
+                self._inference_time_sum -= self.inference_times[0]
+            self.inference_times.append(elapsed_ms)
+            self._inference_time_sum += elapsed_ms
+
+        if return_arrays:
+            return detections, [self._box_array(*output) for output in outputs]
+        return detections
+
+    def _parse_results(self, result, scale: Optional[Tuple[float, float]] = None) -> RawDetections:
+        boxes = result.boxes
+
+        # One device-to-host transfer per tensor instead of three per box
+        return (
+            boxes.cls.cpu().numpy().astype(np.int32),
+            boxes.conf.cpu().numpy(),
+            self._to_pixels(boxes.xyxy.cpu().numpy(), scale)
         )
 
-        self.inference_times.append((time.time() - start_time) * 1000)
-        return self._parse_results(results[0])
+    @staticmethod
+    def _to_pixels(xyxy: np.ndarray, scale: Optional[Tuple[float, float]]) -> np.ndarray:
+        """Integer box corners, mapped back to full resolution for downscaled frames."""
+        if scale is not None:
+            scale_x, scale_y = scale
+            xyxy = xyxy / np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        return xyxy.astype(np.int32)
 
-    def _parse_results(self, result) -> List[Dict[str, Any]]:
-        detections = []
+    @staticmethod
+    def _box_array(class_ids: np.ndarray, confidences: np.ndarray, coords: np.ndarray) -> np.ndarray:
+        """(N, 6) int32 rows of [x1, y1, x2, y2, class_id, confidence %]."""
+        percent = np.rint(confidences * 100)
+        return np.column_stack((coords, class_ids, percent)).astype(np.int32)
 
-        for box in result.boxes:
-            class_id = int(box.cls[0])
-            confidence = float(box.conf[0])
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
+    def _build_detections(self, class_ids: np.ndarray, confidences: np.ndarray,
+                          coords: np.ndarray) -> List[Dict[str, Any]]:
+        names = self.class_names
 
-            detections.append({
+        return [
+            {
                 'class_id': class_id,
-                'class_name': self.class_names[class_id],
+                'class_name': names[class_id],
                 'confidence': confidence,
                 'bbox': {
-                    'x1': int(x1),
-                    'y1': int(y1),
-                    'x2': int(x2),
-                    'y2': int(y2)
+                    'x1': x1,
+                    'y1': y1,
+                    'x2': x2,
+                    'y2': y2
                 }
-            })
-
-        return detections
+            }
+            for class_id, confidence, (x1, y1, x2, y2)
+            in zip(class_ids.tolist(), confidences.tolist(), coords.tolist())
+        ]
 
     def get_avg_inference_time(self) -> float:
-        return sum(self.inference_times) / len(self.inference_times) if self.inference_times else 0.0
+        # Running sum over the last INFERENCE_TIME_WINDOW frames - O(1)
+        return self._inference_time_sum / len(self.inference_times) if self.inference_times else 0.0
 
     def get_fps(self) -> float:
         avg = self.get_avg_inference_time()
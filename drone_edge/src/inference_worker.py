@@ -0,0 +1,64 @@
+"""
+inference_worker.py
+===================
+Persistent inference worker process for the API server
+Loads the YOLOv8 model once and runs analysis jobs from a queue,
+avoiding interpreter startup + model load on every analysis
+"""
+
+import os
+import traceback
+from pathlib import Path
+
+
+def worker_main(job_queue, result_queue, stop_event, firebase_enabled: bool) -> None:
+    """
+    Worker process entry point.
+    
+    Jobs are dicts {"video_path": str, "session_id": str}; a None job shuts
+    the worker down. One result dict is put on result_queue per job.
+    
+    Args:
+        job_queue: multiprocessing.Queue of analysis jobs
+        result_queue: multiprocessing.Queue receiving job results
+        stop_event: multiprocessing.Event set by the API server to stop the current job
+        firebase_enabled: Stream detections to Firebase instead of local storage
+    """
+    # Match the working directory the inference scripts expect (drone_edge/)
+    os.chdir(Path(__file__).resolve().parent.parent)
+    
+    # Heavy imports happen here, once per worker - not in the API process
+    from config import load_config
+    from inference_engine import InferenceEngine
+    from video_processor import configure_opencv
+    
+    if firebase_enabled:
+        import run_inference_firebase as runner
+    else:
+        import run_inference_local as runner
+    
+    config = load_config()
+    configure_opencv(config['performance'].get('opencv_threads', 1))
+    engine = InferenceEngine(
+        model_path=config['model']['path'],
+        conf_threshold=config['model']['confidence_threshold'],
+        tensorrt=config['model'].get('tensorrt', False),
+        raw_inference=config['model'].get('raw_inference', False)
+    )
+    
+    print("🧠 Inference worker ready")
+    
+    while True:
+        job = job_queue.get()
+        
+        if job is None:
+            break
+        
+        try:
+            # Reload config so visualization/output settings changes apply per job
+            config = load_config()
+            runner.run_session(config, engine, job['video_path'], should_stop=stop_event.is_set)
+            result_queue.put({'session_id': job['session_id'], 'success': True})
+        except Exception as e:
+            traceback.print_exc()
+            result_queue.put({'session_id': job['session_id'], 'success': False, 'error': str(e)})
@@ -0,0 +1,192 @@
+"""
+json_io.py
+==========
+Fast JSON (de)serialization and atomic file writes
+Uses orjson when installed, falls back to the stdlib json module
+"""
+
+import os
+import json
+import queue
+import threading
+from pathlib import Path
+from typing import Any, Iterator, List, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def _json_default(obj: Any) -> Any:
+    """Convert numpy scalars/arrays for the stdlib encoder (orjson handles them natively)."""
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any, indent: bool = False) -> bytes:
+    """
+    Serialize an object to UTF-8 JSON bytes.
+    
+    numpy arrays and scalars (e.g. model confidences) are encoded directly,
+    without converting them to Python floats first.
+    
+    Args:
+        obj: JSON-serializable object
+        indent: Pretty-print with 2-space indentation (slower, for manual inspection)
+    """
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, indent=2 if indent else None, default=_json_default).encode('utf-8')
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Parse JSON bytes or text."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def read_json(path: Union[str, Path]) -> Any:
+    """Read and parse a JSON file."""
+    return loads(Path(path).read_bytes())
+
+
+def write_json_atomic(path: Union[str, Path], obj: Any, indent: bool = False) -> None:
+    """
+    Write JSON to a temp file and os.replace() it over the target, so
+    readers (e.g. the API server polling output/) never see a partial file.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_bytes(dumps(obj, indent=indent))
+    os.replace(tmp_path, path)
+
+
+def iter_json_items(path: Union[str, Path], key: str) -> Iterator[Any]:
+    """
+    Iterate the elements of the array stored under a top-level key.
+    
+    Streams with ijson when installed (constant memory for large files),
+    otherwise parses the whole file.
+    """
+    if ijson is not None:
+        with open(path, 'rb') as f:
+            yield from ijson.items(f, f'{key}.item', use_float=True)
+    else:
+        yield from read_json(path).get(key, [])
+
+
+def iter_ndjson(path: Union[str, Path]) -> Iterator[Any]:
+    """
+    Iterate the documents of a newline-delimited JSON file.
+    
+    A truncated last line (writer caught mid-append) is skipped.
+    """
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            yield loads(line)
+
+
+def read_ndjson(path: Union[str, Path]) -> List[Any]:
+    """Read a newline-delimited JSON file into a list."""
+    return list(iter_ndjson(path))
+
+
+class NDJSONWriter:
+    """
+    Append-only newline-delimited JSON log.
+    
+    Each append() is a single unbuffered write() of one line, so per-event
+    cost is O(1) and readers always see every completed event.
+    """
+    
+    def __init__(self, path: Union[str, Path]):
+        """
+        Open (and truncate) the log file.
+        
+        Args:
+            path: NDJSON output path
+        """
+        self.path = Path(path)
+        self._file = open(self.path, 'wb', buffering=0)
+    
+    def append(self, obj: Any) -> None:
+        """Append one JSON document as a line."""
+        self._file.write(dumps(obj) + b'\n')
+    
+    def close(self) -> None:
+        """Close the underlying file (idempotent)."""
+        if not self._file.closed:
+            self._file.close()
+    
+    def finalize(self) -> List[Any]:
+        """Close the log and return every appended document as a list."""
+        self.close()
+        return read_ndjson(self.path)
+
+
+class AsyncNDJSONWriter(NDJSONWriter):
+    """
+    NDJSONWriter that serializes and writes on a background thread.
+    
+    append() only enqueues the document, keeping encoding and the write
+    syscall off the caller's (inference) thread. Documents queued together
+    are written with a single write(). Appended documents must not be
+    mutated afterwards.
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, path: Union[str, Path]):
+        super().__init__(path)
+        self._queue: queue.Queue = queue.Queue()
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._writer_loop, name='ndjson-writer', daemon=True)
+        self._thread.start()
+    
+    def _writer_loop(self) -> None:
+        while True:
+            docs = [self._queue.get()]
+            while True:
+                try:
+                    docs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            stop = docs[-1] is self._STOP
+            if stop:
+                docs.pop()
+            
+            if docs and self._error is None:
+                try:
+                    self._file.write(b''.join(dumps(doc) + b'\n' for doc in docs))
+                except Exception as e:
+                    self._error = e
+            
+            if stop:
+                return
+    
+    def append(self, obj: Any) -> None:
+        """Queue one JSON document for appending."""
+        self._queue.put(obj)
+    
+    def close(self) -> None:
+        """Flush queued documents and close the file (idempotent)."""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        super().close()
+        if self._error is not None:
+            raise self._error
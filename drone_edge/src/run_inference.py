@@ -5,7 +5,11 @@ Main script for running edge inference on drone video
 """
 
 import cv2
+import functools
+import queue
+import threading
 import time
+from collections import deque
 from datetime import datetime
 from pathlib import Path
 import sys
@@ -13,7 +17,116 @@ import sys
 from inference_engine import InferenceEngine
 from video_processor import VideoProcessor
 from detection_formatter import DetectionFormatter
-from config import load_config
+from config import load_config, get_video_input_path
+
+
+# Frames buffered between pipeline stages
+PIPELINE_QUEUE_SIZE = 4
+
+# Longest wait for a batch to fill before running a partial one
+BATCH_TIMEOUT_S = 0.05
+
+# Frames in the moving window used for the on-screen FPS
+FPS_WINDOW = 30
+
+# End-of-stream marker passed between stages
+_END = None
+
+
+def _put(q, item, stop):
+    """Put onto a bounded queue, giving up once the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    """Get from a queue, returning _END once the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _END
+
+
+def capture_stage(video, frames_out, stop, errors):
+    """
+    Producer thread: decode frames into frames_out until the video ends.
+    
+    Args:
+        video: VideoProcessor to read from
+        frames_out: Queue of decoded frames
+        stop: Event set by the consumer to abort the pipeline
+        errors: List collecting exceptions raised in the stage
+    """
+    try:
+        while not stop.is_set():
+            success, frame = video.read_frame()
+            if not success:
+                break
+            if not _put(frames_out, frame, stop):
+                return
+    except BaseException as e:
+        errors.append(e)
+    _put(frames_out, _END, stop)
+
+
+def inference_stage(engine, frames_in, results_out, stop, errors, batch_size=1):
+    """
+    Inference thread: run the model on batches of frames from frames_in.
+    
+    A batch is sent as soon as it holds batch_size frames or BATCH_TIMEOUT_S
+    has passed since its first frame arrived.
+    
+    Args:
+        engine: InferenceEngine
+        frames_in: Queue of decoded frames
+        results_out: Queue of (frame, detections) tuples
+        stop: Event set by the consumer to abort the pipeline
+        errors: List collecting exceptions raised in the stage
+        batch_size: Maximum frames per model call
+    """
+    try:
+        ended = False
+        while not ended:
+            frame = _get(frames_in, stop)
+            if frame is _END:
+                break
+            
+            batch = [frame]
+            deadline = time.perf_counter() + BATCH_TIMEOUT_S
+            while len(batch) < batch_size:
+                try:
+                    frame = frames_in.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if frame is _END:
+                    ended = True
+                    break
+                batch.append(frame)
+            
+            for frame, detections in zip(batch, engine.predict_batch(batch)):
+                if not _put(results_out, (frame, detections), stop):
+                    return
+    except BaseException as e:
+        errors.append(e)
+    _put(results_out, _END, stop)
+
+
+@functools.lru_cache(maxsize=4096)
+def _text_size(label, text_scale, text_thickness):
+    """
+    Cached cv2.getTextSize for label text.
+    
+    Labels come from a small set of class names and 101 confidence
+    percentages, so the (width, height) results repeat constantly.
+    """
+    return cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, text_scale, text_thickness)[0]
 
 
 def draw_detections(frame, detections, config):
@@ -21,7 +134,7 @@ def draw_detections(frame, detections, config):
     Draw bounding boxes and labels on frame.
     
     Args:
-        frame: Input frame (modified in-place)
+        frame: Input frame or cv2.UMat (modified in-place)
         detections: List of detection dictionaries
         config: Visualization config
     
@@ -30,6 +143,14 @@ def draw_detections(frame, detections, config):
     """
     viz_config = config['visualization']
     
+    # Resolve style once per frame, not per detection
+    color = tuple(viz_config['bbox_color'])
+    text_color = tuple(viz_config['text_color'])
+    thickness = viz_config['bbox_thickness']
+    text_scale = viz_config['text_scale']
+    text_thickness = viz_config['text_thickness']
+    show_confidence = viz_config['show_confidence']
+    
     for det in detections:
         bbox = det['bbox']
         class_name = det['class_name']
@@ -40,27 +161,20 @@ def draw_detections(frame, detections, config):
         x2, y2 = bbox['x2'], bbox['y2']
         
         # Draw bounding box
-        color = tuple(viz_config['bbox_color'])
-        thickness = viz_config['bbox_thickness']
         cv2.rectangle(frame, (x1, y1), (x2, y2), color, thickness)
         
         # Create label
-        if viz_config['show_confidence']:
+        if show_confidence:
             label = f"{class_name}: {confidence:.0%}"
         else:
             label = class_name
         
         # Draw label background
-        text_scale = viz_config['text_scale']
-        text_thickness = viz_config['text_thickness']
-        (text_w, text_h), _ = cv2.getTextSize(
-            label, cv2.FONT_HERSHEY_SIMPLEX, text_scale, text_thickness
-        )
+        text_w, text_h = _text_size(label, text_scale, text_thickness)
         
         cv2.rectangle(frame, (x1, y1 - text_h - 10), (x1 + text_w, y1), color, -1)
         
         # Draw label text
-        text_color = tuple(viz_config['text_color'])
         cv2.putText(
             frame, label, (x1, y1 - 5),
             cv2.FONT_HERSHEY_SIMPLEX, text_scale, text_color, text_thickness
@@ -82,16 +196,25 @@ def main():
         # Initialize inference engine
         engine = InferenceEngine(
             model_path=config['model']['path'],
-            conf_threshold=config['model']['confidence_threshold']
+            conf_threshold=config['model']['confidence_threshold'],
+            tensorrt=config['model'].get('tensorrt', False),
+            raw_inference=config['model'].get('raw_inference', False)
         )
         
         # Initialize video processor
-        video = VideoProcessor(config['video']['input_path'])
+        video_path = get_video_input_path(config)
+        video = VideoProcessor(video_path)
         
         # Create output directory
         output_dir = Path(config['output']['output_dir'])
         output_dir.mkdir(exist_ok=True)
         
+        # Rasterize overlays with OpenCL (integrated GPU) when enabled
+        use_opencl = config['visualization'].get('use_opencl', False) and cv2.ocl.haveOpenCL()
+        cv2.ocl.setUseOpenCL(use_opencl)
+        if use_opencl:
+            print("🖌️  Drawing overlays with OpenCL")
+        
         # Storage for detection events
         all_events = []
         
@@ -99,27 +222,44 @@ def main():
         frame_count = 0
         start_time = time.time()
         log_interval = config['performance']['log_interval']
+        frame_times = deque(maxlen=FPS_WINDOW)
         
         print("\n▶️  Starting Inference")
         print("=" * 60)
         print("Press 'q' to quit\n")
         
+        # Capture and inference run in their own threads; this loop is the
+        # sink (formatting, drawing, display), so the stages overlap
+        stop = threading.Event()
+        errors = []
+        batch_size = config['model'].get('batch_size', 1)
+        frames_queue = queue.Queue(maxsize=max(PIPELINE_QUEUE_SIZE, 2 * batch_size))
+        results_queue = queue.Queue(maxsize=max(PIPELINE_QUEUE_SIZE, batch_size))
+        stages = [
+            threading.Thread(target=capture_stage, args=(video, frames_queue, stop, errors),
+                             name='capture', daemon=True),
+            threading.Thread(target=inference_stage,
+                             args=(engine, frames_queue, results_queue, stop, errors, batch_size),
+                             name='inference', daemon=True)
+        ]
+        for stage in stages:
+            stage.start()
+        
         # Main inference loop
         while True:
-            # Read frame
-            success, frame = video.read_frame()
+            item = results_queue.get()
             
-            if not success:
+            if item is _END:
+                if errors:
+                    raise errors[0]
                 print("\n📹 End of video reached")
                 break
             
+            frame, detections = item
             frame_count += 1
             
-            # Run inference
-            detections = engine.predict(frame)
-            
             # Create detection event
-            timestamp = datetime.now().isoformat()
+            timestamp = time.time_ns()
             event = DetectionFormatter.format_detection_event(
                 frame_number=frame_count,
                 timestamp=timestamp,
@@ -135,17 +275,20 @@ def main():
             
             # Draw visualizations
             if config['video']['display_window']:
-                annotated_frame = draw_detections(frame.copy(), detections, config)
+                # Frame is not reused after display - annotate it in place
+                canvas = cv2.UMat(frame) if use_opencl else frame
+                annotated_frame = draw_detections(canvas, detections, config)
                 
-                # Add FPS overlay
-                elapsed = time.time() - start_time
-                fps = frame_count / elapsed if elapsed > 0 else 0
+                # Add FPS overlay (moving average over the last FPS_WINDOW frames)
+                frame_times.append(time.perf_counter())
+                window = frame_times[-1] - frame_times[0]
+                fps = (len(frame_times) - 1) / window if window > 0 else 0
                 cv2.putText(
-                    annotated_frame, f"FPS: {fps:.1f}", (10, 30),
+                    annotated_frame, f"FPS: {fps:5.1f}", (10, 30),
                     cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2
                 )
                 
-                # Display frame
+                # Display frame (imshow accepts UMat without a manual download)
                 cv2.imshow("Drone Edge Inference", annotated_frame)
                 
                 # Check for quit key
@@ -161,6 +304,9 @@ def main():
                 print(f"\n📊 Progress: {progress:.1f}% | FPS: {fps:.1f} | Avg inference: {engine.get_avg_inference_time():.1f}ms")
         
         # Cleanup
+        stop.set()
+        for stage in stages:
+            stage.join()
         video.release()
         cv2.destroyAllWindows()
         
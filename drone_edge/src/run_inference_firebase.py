@@ -11,10 +11,18 @@ from pathlib import Path
 import sys
 
 from inference_engine import InferenceEngine
-from video_processor import VideoProcessor
+from video_processor import AsyncVideoProcessor, configure_opencv
 from detection_formatter import DetectionFormatter
 from firebase_uploader import FirebaseUploader
-from config import load_config
+from config import load_config, get_video_input_path
+
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+# Overlay text positions; the FPS text is only re-formatted when it moves this much
+FPS_TEXT_ORG = (10, 30)
+STATUS_TEXT_ORG = (10, 70)
+FPS_TEXT_STEP = 0.1
 
 
 def draw_detections(frame, detections, config):
@@ -62,28 +70,48 @@ def draw_detections(frame, detections, config):
     return frame
 
 
-def main():
-    """Main inference loop with Firebase streaming."""
-    print("\n" + "="*60)
-    print("🚁 AGRICULTURE DRONE - EDGE INFERENCE WITH FIREBASE")
-    print("="*60)
+def run_session(config, engine, video_path, should_stop=None):
+    """
+    Run one analysis session on a video, streaming detections to Firebase.
+    
+    Args:
+        config: Loaded configuration
+        engine: Initialized InferenceEngine (reused across sessions)
+        video_path: Video to analyse (relative to drone_edge/ or absolute)
+        should_stop: Optional callable polled every frame - return True to stop early
+    
+    Returns:
+        FirebaseUploader for the finished session
+    """
+    # Initialize Firebase uploader (connects on the first upload)
+    uploader = FirebaseUploader(
+        session_id=f"inference_{int(time.time())}",
+        enabled=config.get('upload', {}).get('enabled', True)
+    )
+    
+    # Decided once - headless runs skip drawing, imshow and waitKey entirely
+    display = bool(config['video']['display_window'])
+    video = None
     
     try:
-        # Load configuration
-        config = load_config()
+        # Frames per model call
+        batch_size = config['model'].get('batch_size', 1)
         
-        # Initialize Firebase uploader (also initializes connection)
-        uploader = FirebaseUploader(session_id=f"inference_{int(time.time())}")
-        
-        # Initialize inference engine
-        engine = InferenceEngine(
-            model_path=config['model']['path'],
-            conf_threshold=config['model']['confidence_threshold']
+        # Initialize video processor (decodes ahead on a background thread into
+        # reused buffers - each frame is dropped once its batch is processed).
+        # Sources that drop frames never block the reader, so they get fresh
+        # frames instead - reuse would overwrite the batch being drawn
+        realtime_drop = config['video'].get('realtime_drop', False)
+        drops_frames = realtime_drop or isinstance(video_path, int)
+        video = AsyncVideoProcessor(
+            video_path,
+            queue_size=2 * batch_size,
+            realtime_drop=realtime_drop,
+            frame_pool=0 if drops_frames else batch_size,
+            infer_size=engine.input_size,
+            frame_skip=config['performance'].get('frame_skip', 1)
         )
         
-        # Initialize video processor
-        video = VideoProcessor(config['video']['input_path'])
-        
         # Create output directory
         output_dir = Path(config['output']['output_dir'])
         output_dir.mkdir(exist_ok=True)
@@ -93,126 +121,182 @@ def main():
         
         # Performance tracking
         frame_count = 0
-        start_time = time.time()
+        start_time = time.perf_counter()
         log_interval = config['performance']['log_interval']
+        log_fps = config['performance']['log_fps']
+        shown_fps = 0.0
+        fps_text = "FPS: 0.0"
         
         print("\n▶️  Starting Inference with Firebase Streaming")
         print("=" * 60)
-        print("Press 'q' to quit\n")
+        if display:
+            print("Press 'q' to quit\n")
+        
+        video_ended = False
+        user_quit = False
+        stopped = False
         
         # Main inference loop
-        while True:
-            # Read frame
-            success, frame = video.read_frame()
-            
-            if not success:
-                print("\n📹 End of video reached")
+        while not (video_ended or user_quit):
+            # Check for stop request (persistent worker)
+            if should_stop is not None and should_stop():
+                print("\n⚠️ Analysis stopped")
+                stopped = True
                 break
             
-            frame_count += 1
-            
-            # Run inference
-            detections = engine.predict(frame)
-            
-            # Create detection event
-            timestamp = datetime.now().isoformat()
-            event = DetectionFormatter.format_detection_event(
-                frame_number=frame_count,
-                timestamp=timestamp,
-                detections=detections,
-                frame_shape=frame.shape
-            )
-            
-            # 🔥 UPLOAD TO FIREBASE
-            firebase_key = uploader.upload_detection_event(event)
-            
-            # Store locally as backup
-            all_events.append(event)
+            # Read a batch of frames (full resolution + model-size copies)
+            frames = []
+            infer_frames = []
+            scales = []
+            while len(frames) < batch_size:
+                success, frame, infer_frame, scale = video.read_frame_for_inference()
+                if not success:
+                    print("\n📹 End of video reached")
+                    video_ended = True
+                    break
+                frames.append(frame)
+                infer_frames.append(infer_frame)
+                scales.append(scale)
             
-            # Print detection summary (if detections found)
-            if detections:
-                DetectionFormatter.print_detection_summary(event)
-                if firebase_key:
-                    print(f"  🔥 Firebase key: {firebase_key}")
+            # Run inference (one model call for the whole batch)
+            batch_detections = engine.predict_batch(infer_frames, scales) if frames else []
             
-            # Draw visualizations
-            if config['video']['display_window']:
-                annotated_frame = draw_detections(frame.copy(), detections, config)
+            for frame, detections in zip(frames, batch_detections):
+                frame_count += 1
                 
-                # Add FPS and Firebase status overlay
-                elapsed = time.time() - start_time
-                fps = frame_count / elapsed if elapsed > 0 else 0
-                
-                cv2.putText(
-                    annotated_frame, f"FPS: {fps:.1f}", (10, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2
+                # Create detection event
+                timestamp = time.time_ns()
+                event = DetectionFormatter.format_detection_event(
+                    frame_number=frame_count,
+                    timestamp=timestamp,
+                    detections=detections,
+                    frame_shape=frame.shape
                 )
                 
-                firebase_status = "🔥 LIVE" if firebase_key else "⚠️ OFFLINE"
-                cv2.putText(
-                    annotated_frame, firebase_status, (10, 70),
-                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2
-                )
+                # 🔥 UPLOAD TO FIREBASE
+                firebase_key = uploader.upload_detection_event(event)
                 
-                # Display frame
-                cv2.imshow("Drone Edge Inference + Firebase", annotated_frame)
+                # Store locally as backup
+                all_events.append(event)
                 
-                # Check for quit key
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    print("\n⚠️ User interrupted")
-                    break
-            
-            # Log performance periodically
-            if config['performance']['log_fps'] and frame_count % log_interval == 0:
-                elapsed = time.time() - start_time
-                fps = frame_count / elapsed
-                progress = video.get_progress()
-                print(f"\n📊 Progress: {progress:.1f}% | FPS: {fps:.1f} | Avg inference: {engine.get_avg_inference_time():.1f}ms")
-                print(f"   Firebase uploads: {uploader.frame_count} frames, {uploader.total_detections} detections")
-        
-        # Cleanup
-        video.release()
-        cv2.destroyAllWindows()
+                # Print detection summary (if detections found)
+                if detections:
+                    DetectionFormatter.print_detection_summary(event)
+                    if firebase_key:
+                        print(f"  🔥 Firebase key: {firebase_key}")
+                
+                # Draw visualizations
+                if display:
+                    # The frame is ours until its batch is done - annotate it in place
+                    annotated_frame = draw_detections(frame, detections, config)
+                    
+                    # Add FPS and Firebase status overlay
+                    elapsed = time.perf_counter() - start_time
+                    fps = frame_count / elapsed if elapsed > 0 else 0
+                    if abs(fps - shown_fps) >= FPS_TEXT_STEP:
+                        shown_fps = fps
+                        fps_text = f"FPS: {fps:.1f}"
+                    
+                    # Keys are generated locally - ask the uploader whether writes are landing
+                    if uploader.online:
+                        firebase_status, status_color = "🔥 LIVE", (0, 255, 0)
+                    else:
+                        firebase_status, status_color = "⚠️ OFFLINE", (0, 165, 255)
+                    cv2.putText(annotated_frame, fps_text, FPS_TEXT_ORG, FONT, 1, (0, 255, 0), 2)
+                    cv2.putText(annotated_frame, firebase_status, STATUS_TEXT_ORG, FONT, 1, status_color, 2)
+                    
+                    # Display frame
+                    cv2.imshow("Drone Edge Inference + Firebase", annotated_frame)
+                    
+                    # Check for quit key
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        print("\n⚠️ User interrupted")
+                        user_quit = True
+                        break
+                
+                # Log performance periodically
+                if log_fps and frame_count % log_interval == 0:
+                    elapsed = time.perf_counter() - start_time
+                    fps = frame_count / elapsed
+                    progress = video.get_progress()
+                    print(f"\n📊 Progress: {progress:.1f}% | FPS: {fps:.1f} | Avg inference: {engine.get_avg_inference_time():.1f}ms")
+                    print(f"   Firebase uploads: {uploader.frame_count} frames, {uploader.total_detections} detections")
+        
+    except BaseException as e:
+        uploader.end_session("stopped" if isinstance(e, KeyboardInterrupt) else "failed")
+        raise
+    finally:
+        # Stop the reader thread even when the loop raised
+        if video is not None:
+            video.release()
+        if display:
+            cv2.destroyAllWindows()
+    
+    dropped_frames = video.dropped_frames
+    
+    # End Firebase session
+    uploader.end_session("stopped" if stopped else "completed")
+    
+    # Save local backup
+    if config['output']['save_detections'] and all_events:
+        timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_file = output_dir / f"detections_firebase_{timestamp_str}.json"
+        DetectionFormatter.save_to_json(all_events, str(output_file))
+    
+    # Final statistics
+    elapsed = time.perf_counter() - start_time
+    avg_fps = frame_count / elapsed if elapsed > 0 else 0
+    
+    print("\n" + "="*60)
+    print("✅ INFERENCE COMPLETE")
+    print("="*60)
+    print(f"📊 Statistics:")
+    print(f"   Frames processed: {frame_count}")
+    print(f"   Total detections: {sum(len(e['detections']) for e in all_events)}")
+    print(f"   Elapsed time: {elapsed:.1f}s")
+    print(f"   Average FPS: {avg_fps:.1f}")
+    if dropped_frames:
+        print(f"   Dropped frames (realtime): {dropped_frames}")
+    print(f"   Avg inference time: {engine.get_avg_inference_time():.1f}ms")
+    print(f"\n🔥 Firebase:")
+    print(f"   Session ID: {uploader.session_id}")
+    print(f"   Events uploaded: {uploader.frame_count}")
+    print(f"   Total detections: {uploader.total_detections}")
+    print("="*60 + "\n")
+    
+    return uploader
+
+
+def main():
+    """Main inference loop with Firebase streaming."""
+    print("\n" + "="*60)
+    print("🚁 AGRICULTURE DRONE - EDGE INFERENCE WITH FIREBASE")
+    print("="*60)
+    
+    try:
+        # Load configuration
+        config = load_config()
+        
+        # Leave the CPU cores to the model
+        configure_opencv(config['performance'].get('opencv_threads', 1))
+        
+        # Initialize inference engine
+        engine = InferenceEngine(
+            model_path=config['model']['path'],
+            conf_threshold=config['model']['confidence_threshold'],
+            tensorrt=config['model'].get('tensorrt', False),
+            raw_inference=config['model'].get('raw_inference', False)
+        )
         
-        # End Firebase session
-        uploader.end_session()
-        
-        # Save local backup
-        if config['output']['save_detections'] and all_events:
-            timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_file = output_dir / f"detections_firebase_{timestamp_str}.json"
-            DetectionFormatter.save_to_json(all_events, str(output_file))
-        
-        # Final statistics
-        elapsed = time.time() - start_time
-        avg_fps = frame_count / elapsed if elapsed > 0 else 0
-        
-        print("\n" + "="*60)
-        print("✅ INFERENCE COMPLETE")
-        print("="*60)
-        print(f"📊 Statistics:")
-        print(f"   Frames processed: {frame_count}")
-        print(f"   Total detections: {sum(len(e['detections']) for e in all_events)}")
-        print(f"   Elapsed time: {elapsed:.1f}s")
-        print(f"   Average FPS: {avg_fps:.1f}")
-        print(f"   Avg inference time: {engine.get_avg_inference_time():.1f}ms")
-        print(f"\n🔥 Firebase:")
-        print(f"   Session ID: {uploader.session_id}")
-        print(f"   Events uploaded: {uploader.frame_count}")
-        print(f"   Total detections: {uploader.total_detections}")
-        print("="*60 + "\n")
+        run_session(config, engine, get_video_input_path(config))
         
     except KeyboardInterrupt:
         print("\n\n⚠️ Interrupted by user")
-        if 'uploader' in locals():
-            uploader.end_session()
         cv2.destroyAllWindows()
         sys.exit(0)
         
     except Exception as e:
         print(f"\n❌ Error: {e}")
-        if 'uploader' in locals():
-            uploader.end_session()
         import traceback
         traceback.print_exc()
         sys.exit(1)
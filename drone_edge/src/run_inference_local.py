@@ -6,231 +6,387 @@ API server serves them to frontend via REST
 """
 
 import cv2
+import functools
 import time
-import json
 from datetime import datetime
 from pathlib import Path
 import sys
 
 from inference_engine import InferenceEngine
-from video_processor import VideoProcessor
-from detection_formatter import DetectionFormatter
-from config import load_config
+from video_processor import AsyncVideoProcessor, configure_opencv
+from detection_formatter import DetectionFormatter, iso_timestamp
+from config import load_config, get_video_input_path
+import json_io
 
 
-def draw_detections(frame, detections, config):
-    """Draw bounding boxes and labels on frame."""
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+# Overlay text positions; the FPS text is only re-formatted when it moves this much
+FPS_TEXT_ORG = (10, 30)
+STATUS_TEXT_ORG = (10, 70)
+FPS_TEXT_STEP = 0.1
+
+# Frames are compared for the motion gate at this (luma) resolution
+MOTION_GATE_SIZE = (64, 64)
+
+
+@functools.lru_cache(maxsize=4096)
+def _text_size(label, text_scale, text_thickness):
+    """Cached cv2.getTextSize - labels repeat (class names x confidence %)."""
+    return cv2.getTextSize(label, FONT, text_scale, text_thickness)[0]
+
+
+def _motion_signature(frame):
+    """Downsampled grayscale copy of a frame for the motion gate."""
+    small = cv2.resize(frame, MOTION_GATE_SIZE, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+
+def draw_detections_fast(frame, boxes, config, class_names, label_prefixes):
+    """
+    Draw bounding boxes and labels on frame from the engine's box array.
+    
+    Args:
+        frame: BGR frame, annotated in place
+        boxes: (N, 6) int32 array of [x1, y1, x2, y2, class_id, confidence %]
+            (InferenceEngine.predict_batch(..., return_arrays=True))
+        config: Loaded configuration
+        class_names: InferenceEngine.class_names
+        label_prefixes: InferenceEngine.label_prefixes ("name: " per class id)
+    
+    Returns:
+        The annotated frame
+    """
     viz_config = config['visualization']
     
-    for det in detections:
-        bbox = det['bbox']
-        class_name = det['class_name']
-        confidence = det['confidence']
-        
-        x1, y1 = bbox['x1'], bbox['y1']
-        x2, y2 = bbox['x2'], bbox['y2']
-        
+    # Resolve style once per frame, not per detection
+    bbox_color = tuple(viz_config['bbox_color'])
+    text_color = tuple(viz_config['text_color'])
+    thickness = viz_config['bbox_thickness']
+    text_scale = viz_config['text_scale']
+    text_thickness = viz_config['text_thickness']
+    show_confidence = viz_config['show_confidence']
+    
+    # One conversion to native ints instead of dict lookups per field
+    for x1, y1, x2, y2, class_id, percent in boxes.tolist():
         # Draw bounding box
-        color = tuple(viz_config['bbox_color'])
-        thickness = viz_config['bbox_thickness']
-        cv2.rectangle(frame, (x1, y1), (x2, y2), color, thickness)
+        cv2.rectangle(frame, (x1, y1), (x2, y2), bbox_color, thickness)
         
         # Create label
-        if viz_config['show_confidence']:
-            label = f"{class_name}: {confidence:.0%}"
+        if show_confidence:
+            label = f"{label_prefixes[class_id]}{percent}%"
         else:
-            label = class_name
+            label = class_names[class_id]
         
         # Draw label background
-        text_scale = viz_config['text_scale']
-        text_thickness = viz_config['text_thickness']
-        (text_w, text_h), _ = cv2.getTextSize(
-            label, cv2.FONT_HERSHEY_SIMPLEX, text_scale, text_thickness
-        )
+        text_w, text_h = _text_size(label, text_scale, text_thickness)
         
-        cv2.rectangle(frame, (x1, y1 - text_h - 10), (x1 + text_w, y1), color, -1)
+        cv2.rectangle(frame, (x1, y1 - text_h - 10), (x1 + text_w, y1), bbox_color, -1)
         
         # Draw label text
-        text_color = tuple(viz_config['text_color'])
         cv2.putText(
             frame, label, (x1, y1 - 5),
-            cv2.FONT_HERSHEY_SIMPLEX, text_scale, text_color, text_thickness
+            FONT, text_scale, text_color, text_thickness
         )
     
     return frame
 
 
-def main():
-    """Main inference loop - local storage mode."""
-    print("\n" + "="*60)
-    print("🚁 AGRICULTURE DRONE - EDGE INFERENCE (LOCAL MODE)")
-    print("="*60)
+def run_session(config, engine, video_path, should_stop=None):
+    """
+    Run one analysis session on a video, storing detections locally.
+    
+    Args:
+        config: Loaded configuration
+        engine: Initialized InferenceEngine (reused across sessions)
+        video_path: Video to analyse (relative to drone_edge/ or absolute)
+        should_stop: Optional callable polled every frame - return True to stop early
+    
+    Returns:
+        Final session metadata
+    """
+    # Create session ID
+    session_id = f"local_{int(time.time())}"
+    print(f"📊 Session ID: {session_id}")
+    
+    # Frames per model call
+    batch_size = config['model'].get('batch_size', 1)
+    
+    # Create output directory
+    output_dir = Path(__file__).resolve().parent.parent / "output"
+    output_dir.mkdir(exist_ok=True)
+    
+    # Create detections files for API to serve (live NDJSON log, JSON when finished)
+    detections_log_file = output_dir / "current_detections.ndjson"
+    detections_file = output_dir / "current_detections.json"
+    session_file = output_dir / "current_session.json"
+    
+    # Initialize session metadata
+    session_data = {
+        "session_id": session_id,
+        "start_time": iso_timestamp(time.time_ns()),
+        "status": "active",
+        "video_path": str(video_path),
+        "frame_count": 0,
+        "total_detections": 0
+    }
+    
+    # Save initial session
+    json_io.write_json_atomic(session_file, session_data, indent=True)
+    
+    # Append-only detection log (one line per frame, written off the inference thread)
+    detection_log = json_io.AsyncNDJSONWriter(detections_log_file)
+    
+    # Performance tracking
+    frame_count = 0
+    total_detections = 0
+    start_time = time.perf_counter()
+    log_interval = config['performance']['log_interval']
+    log_fps = config['performance']['log_fps']
+    shown_fps = 0.0
+    fps_text = "FPS: 0.0"
+    
+    # Motion gate: frames that barely differ from the last inferred frame
+    # (sum of absolute differences on a 64x64 gray copy) reuse its detections
+    motion_threshold = config['performance'].get('motion_threshold', 0)
+    reference_signature = None
+    last_detections = ([], None)
+    skipped_inferences = 0
+    
+    # Decided once - headless runs skip drawing, imshow and waitKey entirely
+    display = bool(config['video']['display_window'])
+    
+    print("\n▶️  Starting Inference")
+    print("=" * 60)
+    if display:
+        print("Press 'q' to quit\n")
+    
+    video_ended = False
+    user_quit = False
+    stopped = False
+    video = None
     
     try:
-        # Load configuration
-        config = load_config()
-        
-        # Create session ID
-        session_id = f"local_{int(time.time())}"
-        print(f"📊 Session ID: {session_id}")
-        
-        # Initialize inference engine
-        engine = InferenceEngine(
-            model_path=config['model']['path'],
-            conf_threshold=config['model']['confidence_threshold']
+        # Initialize video processor (decodes ahead on a background thread into
+        # reused buffers - each frame is dropped once its batch is processed).
+        # Sources that drop frames never block the reader, so they get fresh
+        # frames instead - reuse would overwrite the batch being drawn
+        realtime_drop = config['video'].get('realtime_drop', False)
+        drops_frames = realtime_drop or isinstance(video_path, int)
+        video = AsyncVideoProcessor(
+            video_path,
+            queue_size=2 * batch_size,
+            realtime_drop=realtime_drop,
+            frame_pool=0 if drops_frames else batch_size,
+            infer_size=engine.input_size,
+            frame_skip=config['performance'].get('frame_skip', 1)
         )
         
-        # Initialize video processor
-        video = VideoProcessor(config['video']['input_path'])
-        
-        # Create output directory
-        output_dir = Path(__file__).resolve().parent.parent / "output"
-        output_dir.mkdir(exist_ok=True)
-        
-        # Create detections file for API to serve
-        detections_file = output_dir / "current_detections.json"
-        session_file = output_dir / "current_session.json"
-        
-        # Initialize session metadata
-        session_data = {
-            "session_id": session_id,
-            "start_time": datetime.now().isoformat(),
-            "status": "active",
-            "video_path": str(config['video']['input_path']),
-            "frame_count": 0,
-            "total_detections": 0
-        }
-        
-        # Save initial session
-        with open(session_file, 'w') as f:
-            json.dump(session_data, f, indent=2)
-        
-        # Storage for all detections
-        all_detections = []
-        
-        # Performance tracking
-        frame_count = 0
-        total_detections = 0
-        start_time = time.time()
-        log_interval = config['performance']['log_interval']
-        
-        print("\n▶️  Starting Inference")
-        print("=" * 60)
-        print("Press 'q' to quit\n")
-        
         # Main inference loop
-        while True:
-            # Read frame
-            success, frame = video.read_frame()
-            
-            if not success:
-                print("\n📹 End of video reached")
+        while not (video_ended or user_quit):
+            # Check for stop request (persistent worker)
+            if should_stop is not None and should_stop():
+                print("\n⚠️ Analysis stopped")
+                stopped = True
                 break
             
-            frame_count += 1
-            
-            # Run inference
-            detections = engine.predict(frame)
-            
-            # Create detection event
-            timestamp = datetime.now().isoformat()
-            event = DetectionFormatter.format_detection_event(
-                frame_number=frame_count,
-                timestamp=timestamp,
-                detections=detections,
-                frame_shape=frame.shape
-            )
-            
-            # Add session context
-            event['session_id'] = session_id
+            # Read a batch of frames (full resolution + model-size copies)
+            frames = []
+            infer_frames = []
+            scales = []
+            while len(frames) < batch_size:
+                success, frame, infer_frame, scale = video.read_frame_for_inference()
+                if not success:
+                    print("\n📹 End of video reached")
+                    video_ended = True
+                    break
+                frames.append(frame)
+                infer_frames.append(infer_frame)
+                scales.append(scale)
             
-            # Store detection
-            all_detections.append(event)
-            total_detections += len(detections)
+            # Pick the frames that changed enough to need a model call
+            if motion_threshold > 0:
+                changed = []
+                for infer_frame in infer_frames:
+                    signature = _motion_signature(infer_frame)
+                    is_changed = (
+                        reference_signature is None
+                        or cv2.absdiff(signature, reference_signature).sum() >= motion_threshold
+                    )
+                    if is_changed:
+                        reference_signature = signature
+                    changed.append(is_changed)
+            else:
+                changed = [True] * len(frames)
             
-            # Save to file (overwrite each time so API always has latest)
-            with open(detections_file, 'w') as f:
-                json.dump({
-                    "session_id": session_id,
-                    "detections": all_detections
-                }, f)
+            # Run inference (one model call for the whole batch); box arrays feed the overlay
+            inferred = iter(zip(*engine.predict_batch(
+                [infer_frame for infer_frame, is_changed in zip(infer_frames, changed) if is_changed],
+                [scale for scale, is_changed in zip(scales, changed) if is_changed],
+                return_arrays=True
+            )) if any(changed) else [])
             
-            # Print detection summary
-            if detections:
-                DetectionFormatter.print_detection_summary(event)
+            batch_detections = []
+            for is_changed in changed:
+                if is_changed:
+                    last_detections = next(inferred)
+                else:
+                    skipped_inferences += 1
+                batch_detections.append(last_detections)
             
-            # Draw visualizations
-            if config['video']['display_window']:
-                annotated_frame = draw_detections(frame.copy(), detections, config)
-                
-                # Add FPS overlay
-                elapsed = time.time() - start_time
-                fps = frame_count / elapsed if elapsed > 0 else 0
+            for frame, (detections, boxes) in zip(frames, batch_detections):
+                frame_count += 1
                 
-                cv2.putText(
-                    annotated_frame, f"FPS: {fps:.1f}", (10, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2
+                # Create detection event
+                timestamp = time.time_ns()
+                event = DetectionFormatter.format_detection_event(
+                    frame_number=frame_count,
+                    timestamp=timestamp,
+                    detections=detections,
+                    frame_shape=frame.shape
                 )
                 
-                cv2.putText(
-                    annotated_frame, "LOCAL MODE", (10, 70),
-                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2
-                )
+                # Add session context
+                event['session_id'] = session_id
                 
-                # Display frame
-                cv2.imshow("Drone Edge Inference (Local)", annotated_frame)
+                # Store detection (append so API always has latest)
+                detection_log.append(event)
+                total_detections += len(detections)
                 
-                # Check for quit key
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    print("\n⚠️ User interrupted")
-                    break
-            
-            # Log performance periodically
-            if config['performance']['log_fps'] and frame_count % log_interval == 0:
-                elapsed = time.time() - start_time
-                fps = frame_count / elapsed
-                progress = video.get_progress()
-                print(f"\n📊 Progress: {progress:.1f}% | FPS: {fps:.1f} | Avg inference: {engine.get_avg_inference_time():.1f}ms")
-                print(f"   Detections: {total_detections} | Frame: {frame_count}")
-        
-        # Cleanup
-        video.release()
-        cv2.destroyAllWindows()
-        
-        # Update session status
-        session_data["status"] = "completed"
+                # Print detection summary
+                if detections:
+                    DetectionFormatter.print_detection_summary(event)
+                
+                # Draw visualizations
+                if display:
+                    # The frame is ours until its batch is done - annotate it in place
+                    annotated_frame = draw_detections_fast(
+                        frame, boxes, config, engine.class_names, engine.label_prefixes
+                    )
+                    
+                    # Add FPS overlay
+                    elapsed = time.perf_counter() - start_time
+                    fps = frame_count / elapsed if elapsed > 0 else 0
+                    if abs(fps - shown_fps) >= FPS_TEXT_STEP:
+                        shown_fps = fps
+                        fps_text = f"FPS: {fps:.1f}"
+                    
+                    cv2.putText(annotated_frame, fps_text, FPS_TEXT_ORG, FONT, 1, (0, 255, 0), 2)
+                    cv2.putText(annotated_frame, "LOCAL MODE", STATUS_TEXT_ORG, FONT, 1, (0, 255, 255), 2)
+                    
+                    # Display frame
+                    cv2.imshow("Drone Edge Inference (Local)", annotated_frame)
+                    
+                    # Check for quit key
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        print("\n⚠️ User interrupted")
+                        user_quit = True
+                        break
+                
+                # Log performance periodically
+                if log_fps and frame_count % log_interval == 0:
+                    elapsed = time.perf_counter() - start_time
+                    fps = frame_count / elapsed
+                    progress = video.get_progress()
+                    print(f"\n📊 Progress: {progress:.1f}% | FPS: {fps:.1f} | Avg inference: {engine.get_avg_inference_time():.1f}ms")
+                    print(f"   Detections: {total_detections} | Frame: {frame_count}")
+    except BaseException as e:
+        # The persistent worker moves on to its next job - close this session
+        # out instead of leaving it "active" with a live log the API keeps serving
+        session_data["status"] = "stopped" if isinstance(e, KeyboardInterrupt) else "failed"
         session_data["frame_count"] = frame_count
         session_data["total_detections"] = total_detections
-        session_data["end_time"] = datetime.now().isoformat()
+        session_data["end_time"] = iso_timestamp(time.time_ns())
+        json_io.write_json_atomic(session_file, session_data, indent=True)
         
-        with open(session_file, 'w') as f:
-            json.dump(session_data, f, indent=2)
+        # Keep whatever was detected before the failure
+        try:
+            json_io.write_json_atomic(detections_file, {
+                "session_id": session_id,
+                "detections": detection_log.finalize()
+            })
+        except Exception as log_error:
+            print(f"⚠️ Could not save partial detections: {log_error}")
+        detections_log_file.unlink(missing_ok=True)
+        raise
+    finally:
+        if video is not None:
+            video.release()
+        if display:
+            cv2.destroyAllWindows()
+    
+    dropped_frames = video.dropped_frames
+    
+    # Update session status
+    session_data["status"] = "stopped" if stopped else "completed"
+    session_data["frame_count"] = frame_count
+    session_data["total_detections"] = total_detections
+    session_data["end_time"] = iso_timestamp(time.time_ns())
+    
+    json_io.write_json_atomic(session_file, session_data, indent=True)
+    
+    # Convert the NDJSON log into the finalized JSON file
+    all_detections = detection_log.finalize()
+    json_io.write_json_atomic(detections_file, {
+        "session_id": session_id,
+        "detections": all_detections
+    })
+    detections_log_file.unlink()
+    
+    # Save final detections
+    timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
+    final_file = output_dir / f"detections_local_{timestamp_str}.json"
+    json_io.write_json_atomic(final_file, {
+        "session": session_data,
+        "detections": all_detections
+    }, indent=True)
+    
+    # Final statistics
+    elapsed = time.perf_counter() - start_time
+    avg_fps = frame_count / elapsed if elapsed > 0 else 0
+    
+    print("\n" + "="*60)
+    print("✅ INFERENCE COMPLETE")
+    print("="*60)
+    print(f"📊 Statistics:")
+    print(f"   Session ID: {session_id}")
+    print(f"   Frames processed: {frame_count}")
+    print(f"   Total detections: {total_detections}")
+    print(f"   Elapsed time: {elapsed:.1f}s")
+    print(f"   Average FPS: {avg_fps:.1f}")
+    if skipped_inferences:
+        print(f"   Inferences skipped (static frames): {skipped_inferences}")
+    if dropped_frames:
+        print(f"   Dropped frames (realtime): {dropped_frames}")
+    print(f"   Avg inference time: {engine.get_avg_inference_time():.1f}ms")
+    print(f"\n💾 Saved to: {final_file.name}")
+    print("="*60 + "\n")
+    
+    return session_data
+
+
+def main():
+    """Main inference loop - local storage mode."""
+    print("\n" + "="*60)
+    print("🚁 AGRICULTURE DRONE - EDGE INFERENCE (LOCAL MODE)")
+    print("="*60)
+    
+    try:
+        # Load configuration
+        config = load_config()
         
-        # Save final detections
-        timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
-        final_file = output_dir / f"detections_local_{timestamp_str}.json"
-        with open(final_file, 'w') as f:
-            json.dump({
-                "session": session_data,
-                "detections": all_detections
-            }, f, indent=2)
+        # Leave the CPU cores to the model
+        configure_opencv(config['performance'].get('opencv_threads', 1))
         
-        # Final statistics
-        elapsed = time.time() - start_time
-        avg_fps = frame_count / elapsed if elapsed > 0 else 0
+        # Initialize inference engine
+        engine = InferenceEngine(
+            model_path=config['model']['path'],
+            conf_threshold=config['model']['confidence_threshold'],
+            tensorrt=config['model'].get('tensorrt', False),
+            raw_inference=config['model'].get('raw_inference', False)
+        )
         
-        print("\n" + "="*60)
-        print("✅ INFERENCE COMPLETE")
-        print("="*60)
-        print(f"📊 Statistics:")
-        print(f"   Session ID: {session_id}")
-        print(f"   Frames processed: {frame_count}")
-        print(f"   Total detections: {total_detections}")
-        print(f"   Elapsed time: {elapsed:.1f}s")
-        print(f"   Average FPS: {avg_fps:.1f}")
-        print(f"   Avg inference time: {engine.get_avg_inference_time():.1f}ms")
-        print(f"\n💾 Saved to: {final_file.name}")
-        print("="*60 + "\n")
+        run_session(config, engine, get_video_input_path(config))
         
     except KeyboardInterrupt:
         print("\n\n⚠️ Interrupted by user")
@@ -1,40 +1,246 @@
-
 """Environment Verification Script"""
+import os
 import sys
+import json
+import argparse
+import functools
+import sysconfig
+import importlib.util
+from importlib import metadata
+
+# One entry per GPU the NVIDIA kernel driver has bound (Linux)
+NVIDIA_PROC_GPUS = '/proc/driver/nvidia/gpus'
+
+# Without these the CUDA probe is pointless - report the install hint straight away
+CRITICAL_PACKAGES = {'torch', 'ultralytics'}
+
+# Last report, reused until the interpreter or site-packages changes (--force to re-probe)
+ENV_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.agri_sight_env.json')
+REPORT_VERSION = 2  # bump when the report layout/status codes change
+
+# import name -> (display name, distribution names that provide it)
+PACKAGES = {
+    'ultralytics': ('YOLOv8', ('ultralytics',)),
+    'cv2': ('OpenCV', ('opencv-python', 'opencv-python-headless',
+                       'opencv-contrib-python', 'opencv-contrib-python-headless')),
+    'torch': ('PyTorch', ('torch',)),
+    'numpy': ('NumPy', ('numpy',)),
+    'yaml': ('PyYAML', ('PyYAML',)),
+    'PIL': ('Pillow', ('Pillow',))
+}
+
+def _gpu_present():
+    """
+    Whether the NVIDIA driver sees a GPU, read from /proc without loading libcuda.
+    Returns None where the driver exposes no /proc entry (non-Linux, no driver).
+    """
+    if not os.path.isdir(NVIDIA_PROC_GPUS):
+        return None
+    return bool(os.listdir(NVIDIA_PROC_GPUS))
+
+@functools.lru_cache(maxsize=1)
+def _torch():
+    """Import torch once and share the module between the CUDA probes."""
+    import torch
+    return torch
+
+@functools.lru_cache(maxsize=1)
+def _cuda_available():
+    """torch.cuda.is_available(), probed once per process (it initializes the driver)."""
+    torch = _torch()
+    return torch.cuda.is_available()
+
+def _cuda_error():
+    """
+    Allocate a 1-element tensor on the GPU - is_available() can be True on machines
+    where real use fails (driver mismatch, cgroups, MIG). Returns the exception
+    class name, or None when the allocation works.
+    """
+    torch = _torch()
+    try:
+        torch.zeros(1, device='cuda')
+    except Exception as e:
+        return type(e).__name__
+    return None
+
+def _cuda_devices():
+    """(name, memory GB) for each device torch can see - empty if enumeration fails."""
+    torch = _torch()
+    try:
+        return [
+            (props.name, props.total_memory / 1e9)
+            for props in map(torch.cuda.get_device_properties, range(torch.cuda.device_count()))
+        ]
+    except Exception:
+        # device_count() can be > 0 on broken installs
+        return []
+
+def _package_version(package, dists):
+    """
+    Installed version from the distribution metadata (PKG-INFO/METADATA) - no import.
+    Falls back to importing the package for its __version__ when no distribution
+    matches (e.g. a source checkout on sys.path).
+    """
+    for dist in dists:
+        try:
+            return metadata.version(dist)
+        except metadata.PackageNotFoundError:
+            pass
+    
+    try:
+        return getattr(__import__(package), '__version__', 'unknown')
+    except Exception:
+        return 'unknown'
+
+def _glyphs():
+    """
+    Status markers: emoji on a UTF-8 terminal, ASCII when piped/logged or on other
+    encodings (fewer bytes on serial consoles, no UnicodeEncodeError on cp1252).
+    Returns (ok, bad, warn, search, done).
+    """
+    encoding = (getattr(sys.stdout, 'encoding', None) or '').lower()
+    if sys.stdout.isatty() and encoding.startswith('utf'):
+        return '✅', '❌', '⚠️', '🔍', '🎉'
+    return '[OK]', '[X]', '[!]', '[?]', '[OK]'
+
+def _cuda_report():
+    """CUDA status code, allocation error (if any) and visible devices (torch must be installed)."""
+    # torch is only asked when the driver reports a GPU or /proc can't tell us
+    gpu_present = _gpu_present()
+    report = {'status': 'cpu_only', 'error': None, 'devices': []}
+    
+    if gpu_present is False:
+        return report
+    if _cuda_available():
+        report['error'] = _cuda_error()
+        if report['error'] is None:
+            report['status'] = 'available'
+            report['devices'] = [
+                {'name': device_name, 'memory_gb': round(memory_gb, 1)}
+                for device_name, memory_gb in _cuda_devices()
+            ]
+        else:
+            report['status'] = 'unusable'
+    elif gpu_present:
+        report['status'] = 'gpu_unsupported'
+    return report
+
+def _cache_key():
+    """Interpreter path + site-packages mtimes (installing/removing a package changes them)."""
+    paths = sysconfig.get_paths()
+    site_dirs = sorted({paths['purelib'], paths['platlib']})
+    return [REPORT_VERSION, sys.executable] + [os.path.getmtime(path) for path in site_dirs if os.path.isdir(path)]
+
+def _load_cached_report(key):
+    try:
+        with open(ENV_CACHE_FILE, encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return cached.get('report') if cached.get('key') == key else None
 
-def check_imports():
-    packages = {
-        'ultralytics': 'YOLOv8',
-        'cv2': 'OpenCV',
-        'torch': 'PyTorch',
-        'numpy': 'NumPy',
-        'yaml': 'PyYAML',
-        'PIL': 'Pillow'
+def _save_report(key, report):
+    tmp_path = ENV_CACHE_FILE + '.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'report': report}, f)
+        os.replace(tmp_path, ENV_CACHE_FILE)
+    except OSError:
+        pass  # read-only home - just probe every time
+
+def collect_environment(force=False):
+    """
+    Probe Python, the required packages and CUDA.
+    Returns a JSON-serializable report; 'all_good' is False when a package is missing.
+    The report is cached in ENV_CACHE_FILE and reused while the interpreter and
+    site-packages are unchanged, unless force is set.
+    """
+    key = _cache_key()
+    if not force:
+        report = _load_cached_report(key)
+        if report is not None:
+            return report
+    
+    report = _probe_environment()
+    _save_report(key, report)
+    return report
+
+def _probe_environment():
+    # One find_spec pass up front (a sys.path scan each - nothing is imported)
+    missing = {package for package in PACKAGES if importlib.util.find_spec(package) is None}
+    
+    packages = {}
+    for package, (name, dists) in PACKAGES.items():
+        installed = package not in missing
+        packages[name] = {
+            'installed': installed,
+            'version': _package_version(package, dists) if installed else None
+        }
+    
+    if missing & CRITICAL_PACKAGES:
+        cuda = {'status': 'skipped', 'error': None, 'devices': []}
+    else:
+        cuda = _cuda_report()
+    
+    return {
+        'python': {'version': sys.version.split()[0], 'executable': sys.executable},
+        'packages': packages,
+        'cuda': cuda,
+        'all_good': not missing
     }
+
+def check_imports(force=False) -> bool:
+    """Print the environment report. Returns True when every package is installed."""
+    ok, bad, warn, search, done = _glyphs()
     
-    print("🔍 Checking Python Environment\n")
-    print(f"Python: {sys.version.split()[0]}")
-    print(f"Location: {sys.executable}\n")
+    # Banner goes out immediately; the rest is written once at the end
+    print(f"{search} Checking Python Environment\n", flush=True)
+    report = collect_environment(force)
     
-    all_good = True
-    for package, name in packages.items():
-        try:
-            mod = __import__(package)
-            version = getattr(mod, '__version__', 'unknown')
-            print(f"✅ {name:15} {version}")
-        except ImportError:
-            print(f"❌ {name:15} NOT INSTALLED")
-            all_good = False
-    
-    # Check CUDA availability
-    import torch
-    print(f"\n{'GPU (CUDA):':15} {'✅ Available' if torch.cuda.is_available() else '⚠️ Not available (CPU only)'}")
+    out = []
+    out.append(f"Python: {report['python']['version']}")
+    out.append(f"Location: {report['python']['executable']}\n")
+    
+    for name, info in report['packages'].items():
+        if info['installed']:
+            out.append(f"{ok} {name:15} {info['version']}")
+        else:
+            out.append(f"{bad} {name:15} NOT INSTALLED")
+    
+    cuda = report['cuda']
+    cuda_status = {
+        'cpu_only': f'{warn} Not available (CPU only)',
+        'skipped': f'{warn} Not checked (install torch/ultralytics first)',
+        'available': f'{ok} Available',
+        'unusable': f"{warn} Detected but unusable: {cuda['error']}",
+        'gpu_unsupported': f"{warn} GPU detected but torch can't use it"
+    }[cuda['status']]
+    out.append(f"\n{'GPU (CUDA):':15} {cuda_status}")
     
-    if all_good:
-        print("\n🎉 Environment ready for Part 3!")
+    for index, device in enumerate(cuda['devices']):
+        out.append(f"  GPU{index}: {device['name']} {device['memory_gb']:.1f}GB")
+    
+    if report['all_good']:
+        out.append(f"\n{done} Environment ready for Part 3!")
     else:
-        print("\n❌ Missing packages - run: pip install -r requirements.txt")
+        out.append(f"\n{bad} Missing packages - run: pip install -r requirements.txt")
+    
+    sys.stdout.write('\n'.join(out) + '\n')
+    sys.stdout.flush()
+    
+    return report['all_good']
 
 if __name__ == "__main__":
-    check_imports()
-
+    # Exit code 1 when packages are missing, so `python verify_env.py && ...` works as a pre-flight gate
+    parser = argparse.ArgumentParser(description="Verify the drone_edge Python environment")
+    parser.add_argument('--json', action='store_true', help="Print a machine-readable report")
+    parser.add_argument('--force', action='store_true', help="Ignore the cached result and probe again")
+    args = parser.parse_args()
+    
+    if args.json:
+        report = collect_environment(args.force)
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        sys.exit(0 if report['all_good'] else 1)
+    
+    sys.exit(0 if check_imports(args.force) else 1)